@@ -257,6 +257,34 @@ os.makedirs(MEDIA_ROOT, exist_ok=True)
 
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
+# ✅ تخزين الملفات على S3 (اختياري) - يُفعَّل فقط إذا تم تحديد AWS_STORAGE_BUCKET_NAME
+# وكانت django-storages و boto3 مثبتة. الرفع يتم بشكل multipart على أجزاء (8MB)
+# بدلاً من إرسال الملف كاملاً في طلب واحد.
+AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
+USE_S3 = False
+if AWS_STORAGE_BUCKET_NAME:
+    try:
+        import storages  # noqa: F401
+        from boto3.s3.transfer import TransferConfig
+
+        USE_S3 = True
+        AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME")
+        AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")  # MinIO / S3-compatible
+        AWS_S3_FILE_OVERWRITE = False
+        AWS_DEFAULT_ACL = None
+        AWS_S3_TRANSFER_CONFIG = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=10,
+        )
+        STORAGES = {
+            "default": {"BACKEND": "storages.backends.s3.S3Storage"},
+            "staticfiles": {"BACKEND": STATICFILES_STORAGE},
+        }
+    except ImportError:
+        # django-storages/boto3 غير مثبتة - نكمل بالتخزين المحلي (MEDIA_ROOT)
+        pass
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # =========================
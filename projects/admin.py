@@ -100,22 +100,8 @@ class SitePlanOwnerAdmin(admin.ModelAdmin):
         
         # ✅ إذا لم يكن هناك اسم محفوظ أو كان فارغاً، نحسبه من الملاك مباشرة
         if not project_name:
-            siteplan = obj.siteplan
-            owners = siteplan.owners.order_by("id")
-            owners_count = owners.count()
-            
-            main_name = ""
-            for owner in owners:
-                ar = (owner.owner_name_ar or "").strip()
-                en = (owner.owner_name_en or "").strip()
-                if ar or en:
-                    main_name = ar or en
-                    break
-            
-            if main_name:
-                project_name = f"{main_name} وشركاؤه" if owners_count > 1 else main_name
-            else:
-                project_name = f"Project #{project.id}"
+            # ✅ values_list عبر SitePlanOwner.display_name_for (بدون إنشاء كائنات الملاك)
+            project_name = SitePlanOwner.display_name_for(obj.siteplan_id) or f"Project #{project.id}"
         
         return format_html('<a href="{}">{}</a>', url, project_name)
     project_link.short_description = "المشروع"
@@ -166,6 +152,7 @@ class SitePlanOwnerInline(admin.TabularInline):
 @admin.register(SitePlan)
 class SitePlanAdmin(admin.ModelAdmin):
     list_display = ("id", "project", "municipality", "zone", "sector", "land_no", "plot_area_sqm", "created_at")
+    list_select_related = ("project",)
     list_filter = ("municipality", "zone", "sector")
     search_fields = ("project__name", "land_no", "plot_address")
     inlines = [SitePlanOwnerInline]
@@ -175,6 +162,7 @@ class SitePlanAdmin(admin.ModelAdmin):
 @admin.register(BuildingLicense)
 class BuildingLicenseAdmin(admin.ModelAdmin):
     list_display = ("id", "project", "license_no", "license_type", "issue_date", "contractor_name", "created_at")
+    list_select_related = ("project",)
     list_filter = ("license_type", "city", "zone", "sector")
     search_fields = ("license_no", "project__name", "contractor_name", "consultant_name")
 
@@ -183,6 +171,7 @@ class BuildingLicenseAdmin(admin.ModelAdmin):
 @admin.register(Contract)
 class ContractAdmin(admin.ModelAdmin):
     list_display = ("id", "project", "contract_type", "contract_date", "total_project_value", "created_at")
+    list_select_related = ("project",)
     list_filter = ("contract_type",)
     search_fields = ("project__name", "tender_no", "contractor_name")
 
@@ -191,6 +180,7 @@ class ContractAdmin(admin.ModelAdmin):
 @admin.register(Awarding)
 class AwardingAdmin(admin.ModelAdmin):
     list_display = ("id", "project", "award_date", "project_number", "created_at")
+    list_select_related = ("project",)
     search_fields = ("project__name", "project_number", "consultant_registration_number", "contractor_registration_number")
 
 
@@ -198,6 +188,7 @@ class AwardingAdmin(admin.ModelAdmin):
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ("id", "project", "amount", "date", "description", "created_at")
+    list_select_related = ("project",)
     list_filter = ("date", "project")
     search_fields = ("project__name", "description")
     date_hierarchy = "date"
@@ -263,5 +254,6 @@ class ConsultantAdmin(admin.ModelAdmin):
 @admin.register(ProjectConsultant)
 class ProjectConsultantAdmin(admin.ModelAdmin):
     list_display = ("id", "project", "consultant", "role", "created_at")
+    list_select_related = ("project", "consultant")
     list_filter = ("role", "consultant__tenant")
     search_fields = ("project__name", "consultant__name", "consultant__name_en")
@@ -0,0 +1,71 @@
+"""
+Management command لإعادة حساب اسم العرض (Project.name) لجميع المشاريع من الملاك
+"""
+from django.core.management.base import BaseCommand
+from projects.models import Project, SitePlanOwner
+
+
+class Command(BaseCommand):
+    help = 'إعادة حساب Project.name من ملاك SitePlan (المالك المفوض + "وشركاؤه")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--force', action='store_true',
+            help='استبدال الأسماء الموجودة أيضاً (افتراضياً تُملأ الأسماء الفارغة فقط)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='عرض التغييرات بدون حفظها')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.force = options['force']
+        self.dry_run = options['dry_run']
+        projects = Project.objects.filter(siteplan__isnull=False).only('id', 'name', 'siteplan__id').select_related('siteplan')
+        total = 0
+        updated = 0
+
+        self.stdout.write('🔍 جاري إعادة حساب أسماء المشاريع...\n')
+
+        batch = []
+        for project in projects.iterator(chunk_size=batch_size):
+            batch.append(project)
+            if len(batch) >= batch_size:
+                updated += self._update_batch(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            updated += self._update_batch(batch)
+            total += len(batch)
+
+        self.stdout.write('\n' + '=' * 50)
+        if self.dry_run:
+            self.stdout.write(self.style.WARNING(f'🔎 (dry-run) سيتم تحديث {updated} من {total} مشروع'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✅ تم تحديث {updated} من {total} مشروع'))
+        self.stdout.write('=' * 50)
+
+    def _update_batch(self, projects):
+        """حساب الأسماء لدفعة من المشاريع باستعلام ملاك واحد + bulk_update"""
+        rows_by_siteplan = {}
+        owners = (
+            SitePlanOwner.objects
+            .filter(siteplan_id__in=[p.siteplan.id for p in projects])
+            .order_by('siteplan_id', *SitePlanOwner.DISPLAY_NAME_ORDERING)
+            .values_list('siteplan_id', 'is_authorized', 'owner_name_ar', 'owner_name_en')
+        )
+        for siteplan_id, *row in owners:
+            rows_by_siteplan.setdefault(siteplan_id, []).append(row)
+
+        changed = []
+        for project in projects:
+            # ✅ لا نستبدل اسماً أدخله المستخدم إلا مع --force
+            if not self.force and (project.name or '').strip():
+                continue
+            new_name = SitePlanOwner.display_name_from_rows(rows_by_siteplan.get(project.siteplan.id, []))
+            if new_name and project.name != new_name:
+                self.stdout.write(f'✅ المشروع #{project.id}: "{project.name}" → "{new_name}"')
+                project.name = new_name
+                changed.append(project)
+        if changed and not self.dry_run:
+            Project.objects.bulk_update(changed, ['name'])
+        return len(changed)
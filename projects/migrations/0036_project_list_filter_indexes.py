@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-15 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0035_add_schedule_file_to_project_schedule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['tenant', '-created_at'], name='project_tenant_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['tenant', 'approval_status', '-created_at'], name='project_tenant_approval_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['tenant', 'status', '-created_at'], name='project_tenant_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['tenant', 'current_stage', '-created_at'], name='project_tenant_stage_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-15 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+        ('projects', '0036_project_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='actualinvoice',
+            name='invoice_number',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='actualinvoice',
+            constraint=models.UniqueConstraint(condition=models.Q(('invoice_number__isnull', False)), fields=('invoice_number',), name='uniq_invoice_number_notnull'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-15 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+        ('projects', '0037_invoice_number_partial_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['project', '-date', '-created_at'], name='payment_project_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variation',
+            index=models.Index(fields=['project', '-approval_date', '-created_at'], name='var_project_date_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-15 22:56
+
+import projects.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0038_variation_payment_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='buildinglicense',
+            name='siteplan_snapshot',
+            field=models.JSONField(default=dict, editable=False, encoder=projects.models.SnapshotJSONEncoder),
+        ),
+        migrations.AlterField(
+            model_name='contract',
+            name='license_snapshot',
+            field=models.JSONField(default=dict, editable=False, encoder=projects.models.SnapshotJSONEncoder),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-15 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+        ('projects', '0039_snapshot_json_encoder'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['tenant', '-date', '-created_at'], name='payment_tenant_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-date', '-created_at'], name='payment_date_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['project', 'payer'], name='payment_project_payer_idx'),
+        ),
+    ]
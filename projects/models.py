@@ -1,8 +1,51 @@
+import datetime
+import functools
+import json
+import logging
 import os
+import re
+from pathlib import PurePosixPath
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
 from decimal import Decimal
-from .utils import get_project_file_path, get_project_from_instance, get_project_folder_name, sanitize_filename
+from .utils import get_project_file_path, get_project_from_instance, make_upload_to
+
+try:
+    import orjson
+except ImportError:  # orjson اختياري - الرجوع إلى json القياسي
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# ✅ نمط تنظيف رقم الهوية (مُجمَّع مرة واحدة)
+_ID_CLEAN_RE = re.compile(r'[-\s]')
+
+# ✅ أسماء الملفات الثابتة (الاسم_العربي_English_Name بدون امتداد)
+_SITEPLAN_FN = 'مخطط_الأرض_Site_Plan'
+_ID_FN_OWNER = 'بطاقة_الهوية_Owner_ID_Card'
+_ID_FN_AUTH = 'بطاقة_الهوية_المفوض_Authorized_Owner_ID_Card'
+_LICENSE_FN = 'رخصة_البناء_Building_Permit'
+_DRAWINGS_SUBFOLDER = 'مخططات_العقد'
+
+class SnapshotJSONEncoder(json.JSONEncoder):
+    """
+    ✅ encoder للقطات (siteplan_snapshot / license_snapshot)
+    - يستخدم orjson (C) إذا كان مثبتاً، وإلا json القياسي
+    - التواريخ تُمرَّر كما هي داخل اللقطة وتتحول إلى ISO هنا
+    """
+    def encode(self, o):
+        if orjson is not None:
+            try:
+                return orjson.dumps(o).decode()
+            except TypeError:
+                pass  # نوع غير مدعوم في orjson - نكمل بالمسار القياسي
+        return super().encode(o)
+
+    def default(self, o):
+        if isinstance(o, (datetime.date, datetime.datetime)):
+            return o.isoformat()
+        return super().default(o)
+
 
 # ====== أساس timestamps ======
 class TimeStampedModel(models.Model):
@@ -25,6 +68,40 @@ class TimeStampedModel(models.Model):
 
 
 # ====== المشروع ======
+class ProjectQuerySet(models.QuerySet):
+    def for_status_calc(self):
+        """تحميل العقد والدفعات مسبقاً لحساب الحالة بدون N+1"""
+        from django.apps import apps
+        Payment = apps.get_model('projects', 'Payment')
+        return self.select_related('contract').prefetch_related(
+            models.Prefetch(
+                'payments',
+                queryset=Payment.objects.only(
+                    'project', 'amount', 'date', 'description', 'created_at'
+                ).order_by('date', 'created_at'),
+            )
+        )
+
+    def with_payment_totals(self):
+        """إضافة مجموع الدفعات وعددها وتاريخ آخر دفعة كـ annotations محسوبة في SQL"""
+        from django.db.models import Count, Max, Sum
+        from django.db.models.functions import Coalesce
+        return self.annotate(
+            total_paid=Coalesce(Sum('payments__amount'), Decimal('0'), output_field=models.DecimalField(max_digits=14, decimal_places=2)),
+            payments_cnt=Count('payments'),
+            last_payment_date=Max('payments__date'),
+        )
+
+    def with_completion_flags(self):
+        """وجود مخطط الأرض/الرخصة/العقد كـ Exists annotations (بدل 3 استعلامات لكل مشروع)"""
+        from django.apps import apps
+        from django.db.models import Exists, OuterRef
+        flags = {}
+        for name, model_name in (('_has_siteplan', 'SitePlan'), ('_has_license', 'BuildingLicense'), ('_has_contract', 'Contract')):
+            model = apps.get_model('projects', model_name)
+            flags[name] = Exists(model.objects.filter(project_id=OuterRef('pk')))
+        return self.annotate(**flags)
+
 class Project(TimeStampedModel):
     # Multi-Tenant: ربط المشروع بالشركة (Tenant)
     tenant = models.ForeignKey(
@@ -167,6 +244,8 @@ class Project(TimeStampedModel):
         """التحقق من أن المشروع معتمد نهائياً"""
         return self.approval_status == 'final_approved'
 
+    objects = ProjectQuerySet.as_manager()
+
     class Meta:
         verbose_name = "مشروع"
         verbose_name_plural = "مشاريع"
@@ -176,6 +255,11 @@ class Project(TimeStampedModel):
         # لذلك نستخدم validation في serializer للتحقق من التكرار
         indexes = [
             models.Index(fields=['tenant', 'internal_code']),
+            # ✅ فهارس مركبة مطابقة لفلاتر القوائم مع ترتيب -created_at (تجنب الفرز)
+            models.Index(fields=['tenant', '-created_at'], name='project_tenant_created_idx'),
+            models.Index(fields=['tenant', 'approval_status', '-created_at'], name='project_tenant_approval_idx'),
+            models.Index(fields=['tenant', 'status', '-created_at'], name='project_tenant_status_idx'),
+            models.Index(fields=['tenant', 'current_stage', '-created_at'], name='project_tenant_stage_idx'),
         ]
 
     def __str__(self):
@@ -192,34 +276,43 @@ class Project(TimeStampedModel):
         5. قيد الإغلاق المالي: إذا تبقى مبلغ أقل من 5% من إجمالي قيمة العقد
         6. تم الانتهاء: عند تنفيذ التسوية المالية النهائية واكتمال نسبة الإنجاز إلى 100%
         """
+        from django.core.exceptions import ObjectDoesNotExist
         from django.utils import timezone
+        from django.db.models import Count, Sum
         from datetime import timedelta
         from decimal import Decimal
         
-        # الحصول على العقد
-        contract = None
-        total_contract_value = Decimal('0')
+        # الحصول على العقد (يستفيد من select_related('contract') إن وُجد)
         try:
-            # ✅ استخدام getattr لتجنب DoesNotExist exception
-            if hasattr(self, '_contract_cache'):
-                contract = self._contract_cache
-            elif hasattr(self, 'contract'):
-                try:
-                    contract = self.contract
-                    self._contract_cache = contract
-                    total_contract_value = contract.total_project_value or Decimal('0')
-                except Exception:
-                    contract = None
-        except Exception:
-            pass
+            contract = self.contract
+        except ObjectDoesNotExist:
+            contract = None
+        total_contract_value = (contract.total_project_value if contract else None) or Decimal('0')
         
-        # الحصول على جميع الدفعات مرتبة حسب التاريخ
-        try:
-            payments = self.payments.all().order_by('date', 'created_at')
-            payments_count = payments.count()
-        except Exception:
-            # ✅ في حالة عدم وجود جدول الدفعات أو خطأ، نرجع الحالة الافتراضية
-            return 'not_started'
+        # ✅ استخدام annotations من with_payment_totals() إن وُجدت (بدون أي استعلام إضافي)
+        # ✅ أو الدفعات المحمّلة مسبقاً (for_status_calc)، وإلا تجميع في استعلام واحد
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('payments')
+        if hasattr(self, 'total_paid') and hasattr(self, 'payments_cnt'):
+            payments_count = self.payments_cnt
+            total_paid = self.total_paid
+            # الوصف لا يغيّر النتيجة، لذلك يكفي تاريخ آخر دفعة
+            last_payment = {'date': self.last_payment_date} if payments_count else None
+        elif prefetched is not None:
+            payments_list = list(prefetched)
+            payments_count = len(payments_list)
+            total_paid = sum((p.amount for p in payments_list), Decimal('0'))
+            if payments_list:
+                # ✅ لا نفترض ترتيب الـ prefetch (قد يختلف حسب الـ view)
+                latest = max(payments_list, key=lambda p: (p.date, p.created_at))
+                last_payment = {'date': latest.date}
+            else:
+                last_payment = None
+        else:
+            # ✅ التجميع يعيد count=0 و total=None عند عدم وجود دفعات
+            totals = self.payments.aggregate(total_paid=Sum('amount'), payments_count=Count('id'))
+            payments_count = totals['payments_count'] or 0
+            total_paid = totals['total_paid'] or Decimal('0')
+            last_payment = None
         
         # 0. لم يبدأ بعد: توقيع العقد فقط ولم تُسجل أي دفعة
         if payments_count == 0:
@@ -229,43 +322,42 @@ class Project(TimeStampedModel):
             # إذا لم يكن هناك عقد، نرجع الحالة الافتراضية
             return 'not_started'
         
-        # الحصول على آخر دفعة
-        last_payment = payments.last()
-        total_paid = sum(Decimal(str(p.amount)) for p in payments)
+        # ✅ الحصول على تاريخ آخر دفعة فقط في استعلام ثانٍ
+        if last_payment is None:
+            last_payment = (
+                self.payments.order_by('-date', '-created_at')
+                .values('date')
+                .first()
+            )
         
-        # حساب نسبة الإنجاز
-        completion_percentage = 0
-        if total_contract_value > 0:
-            completion_percentage = float((total_paid / total_contract_value) * 100)
+        # حساب نسبة الإنجاز (Decimal بالكامل بدون تحويل إلى float)
+        completion_percentage = (
+            total_paid * Decimal('100') / total_contract_value
+            if total_contract_value > 0 else Decimal('0')
+        )
         
         # 6. تم الانتهاء: 100% إنجاز
-        if completion_percentage >= 100:
+        if completion_percentage >= Decimal('100'):
             return 'completed'
         
         # 4. في مرحلة التسليم: 91% أو أكثر (لكن أقل من 100%)
-        if completion_percentage >= 91:
+        if completion_percentage >= Decimal('91'):
             return 'handover_stage'
         
         # 5. قيد الإغلاق المالي: تبقى أقل من 5% (لكن لم يصل 91% بعد)
         if total_contract_value > 0:
-            remaining = total_contract_value - total_paid
-            remaining_percentage = float((remaining / total_contract_value) * 100)
-            if remaining_percentage < 5 and completion_percentage < 91:
+            remaining_percentage = Decimal('100') - completion_percentage
+            if remaining_percentage < Decimal('5') and completion_percentage < Decimal('91'):
                 return 'pending_financial_closure'
         
         # 3. متوقف مؤقتا: آخر دفعة قبل أكثر من 6 أشهر (لكن لم يصل 91% بعد)
         if last_payment:
             six_months_ago = timezone.now().date() - timedelta(days=180)
-            if last_payment.date < six_months_ago and completion_percentage < 91:
+            if last_payment['date'] < six_months_ago and completion_percentage < Decimal('91'):
                 return 'temporarily_suspended'
         
-        # 1. بدأ التنفيذ: دفعة مقدمة فقط
+        # 1. بدأ التنفيذ: دفعة واحدة (مقدمة أو غيرها - النتيجة واحدة، لا حاجة لفحص الوصف)
         if payments_count == 1:
-            # التحقق من أن الدفعة هي دفعة مقدمة (من الوصف)
-            payment_desc = (last_payment.description or "").lower()
-            if 'advance' in payment_desc or 'مقدمة' in payment_desc or 'مقدم' in payment_desc:
-                return 'execution_started'
-            # إذا لم تكن دفعة مقدمة صريحة، نعتبرها بداية التنفيذ
             return 'execution_started'
         
         # 2. قيد التنفيذ: أكثر من دفعة واحدة (ولم تصل للحالات الأخرى)
@@ -281,23 +373,56 @@ class Project(TimeStampedModel):
             new_status = self.calculate_status_from_payments()
             if self.status != new_status:
                 # ✅ استخدام update لتجنب إطلاق signals مرة أخرى
-                Project.objects.filter(pk=self.pk).update(status=new_status)
+                # ✅ تحديث مشروط: لا كتابة إذا كانت الحالة في قاعدة البيانات صحيحة بالفعل
+                changed = (
+                    Project.objects.filter(pk=self.pk)
+                    .exclude(status=new_status)
+                    .update(status=new_status)
+                )
                 # ✅ تحديث instance المحلي
                 self.status = new_status
-                return True
+                return bool(changed)
         except Exception as e:
             # ✅ في حالة أي خطأ، نكمل بدون تحديث الحالة
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error updating project status from payments: {e}", exc_info=True)
         return False
 
+    @classmethod
+    def bulk_update_status_from_payments(cls, project_ids=None, on_error=None):
+        """
+        تحديث حالة عدة مشاريع دفعة واحدة (استعلام تجميعي واحد + bulk_update)
+        project_ids=None: جميع المشاريع
+        on_error(project, exc): لتجاوز المشروع الذي فشل حسابه بدلاً من إيقاف العملية
+        يرجع قائمة (project, old_status) للمشاريع التي تغيّرت حالتها
+        """
+        projects = cls.objects.select_related('contract').with_payment_totals()
+        if project_ids is not None:
+            projects = projects.filter(pk__in=project_ids)
+        changes = []
+        for project in projects:
+            try:
+                new_status = project.calculate_status_from_payments()
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(project, e)
+                continue
+            if project.status != new_status:
+                changes.append((project, project.status))
+                project.status = new_status
+        if changes:
+            cls.objects.bulk_update([project for project, _ in changes], ['status'], batch_size=1000)
+        return changes
+
     # Properties للـ serializer
+    # ✅ تستخدم annotations من with_completion_flags() إن وُجدت، وإلا استعلام exists()
     @property
     def has_siteplan(self):
         """تحقق من وجود SitePlan للمشروع"""
+        if hasattr(self, '_has_siteplan'):
+            return self._has_siteplan
         # ✅ التحقق من وجود related object
-        if not hasattr(self, '_state') or self._state.adding or not self.pk:
+        if self._state.adding or not self.pk:
             # ✅ إذا كان المشروع جديداً (لم يُحفظ بعد)، نرجع False
             return False
         # ✅ استخدام query مباشر لتجنب DoesNotExist exception
@@ -306,26 +431,32 @@ class Project(TimeStampedModel):
     @property
     def has_license(self):
         """تحقق من وجود BuildingLicense للمشروع"""
+        if hasattr(self, '_has_license'):
+            return self._has_license
         # ✅ التحقق من وجود related object
-        if not hasattr(self, '_state') or self._state.adding or not self.pk:
+        if self._state.adding or not self.pk:
             # ✅ إذا كان المشروع جديداً (لم يُحفظ بعد)، نرجع False
             return False
         # ✅ استخدام query مباشر لتجنب DoesNotExist exception
         return BuildingLicense.objects.filter(project_id=self.pk).exists()
 
+    @property
+    def has_contract(self):
+        """تحقق من وجود Contract للمشروع"""
+        if hasattr(self, '_has_contract'):
+            return self._has_contract
+        if self._state.adding or not self.pk:
+            return False
+        return Contract.objects.filter(project_id=self.pk).exists()
+
     @property
     def completion(self):
         """نسبة إكمال المشروع بناءً على الخطوات المكتملة"""
-        if not hasattr(self, '_state') or self._state.adding or not self.pk:
+        if self._state.adding or not self.pk:
             return 0
-        completed = 0
-        if self.has_siteplan:
-            completed += 1
-        if self.has_license:
-            completed += 1
-        if Contract.objects.filter(project_id=self.pk).exists():
-            completed += 1
-        return int((completed / 3) * 100) if completed > 0 else 0
+        # ✅ حساب صحيح بدون float: 0 / 33 / 66 / 100
+        completed = int(self.has_siteplan) + int(self.has_license) + int(self.has_contract)
+        return (completed * 100) // 3
 
 
 # ====== مخطط الأرض ======
@@ -366,20 +497,18 @@ class SitePlan(TimeStampedModel):
         """حفظ ملف مخطط الأرض في المسار المنظم للمشروع."""
         project = get_project_from_instance(instance)
         # ✅ استخدام اسم ملف ثابت: مخطط_الأرض_Site_Plan
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"مخطط_الأرض_Site_Plan{ext}"
+        ext = os.path.splitext(filename)[1] or '.pdf'
         if project:
             # حفظ مباشرة في Project Info- معلومات المشروع بدون subfolder
-            return get_project_file_path(project, 'project_info', clean_filename)
+            return get_project_file_path(project, 'project_info', _SITEPLAN_FN + ext)
         # Fallback للتوافق مع البيانات القديمة
-        project_part = instance.project_id or "project"
-        return f"siteplans/applications/{project_part}/مخطط_الأرض{ext}"
+        return str(PurePosixPath('siteplans/applications', str(instance.project_id or 'project'), 'مخطط_الأرض' + ext))
     
     application_file = models.FileField(upload_to=get_application_file_path, null=True, blank=True)
 
     def __str__(self):
-        return f"SitePlan #{self.id} for {self.project.name or self.project_id}"
+        # ✅ project_id فقط لتجنب استعلام Project عند كل str()
+        return f"SitePlan #{self.id} for {self.project_id}"
 
 
 class SitePlanOwner(TimeStampedModel):
@@ -396,20 +525,15 @@ class SitePlanOwner(TimeStampedModel):
     def get_id_attachment_path(instance, filename):
         """حفظ ملف بطاقة الهوية في Project Info- معلومات المشروع."""
         project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
+        ext = os.path.splitext(filename)[1] or '.pdf'
         # ✅ استخدام اسم ملف موحد: بطاقة_الهوية_ID_Card (بدون أرقام عشوائية)
         # ✅ التمييز بين المالك والمفوض
-        is_authorized = getattr(instance, 'is_authorized', False)
-        if is_authorized:
-            clean_filename = f"بطاقة_الهوية_المفوض_Authorized_Owner_ID_Card{ext}"
-        else:
-            clean_filename = f"بطاقة_الهوية_Owner_ID_Card{ext}"
+        clean_filename = (_ID_FN_AUTH if getattr(instance, 'is_authorized', False) else _ID_FN_OWNER) + ext
         if project:
             # حفظ مباشرة في Project Info- معلومات المشروع بدون subfolder
             return get_project_file_path(project, 'project_info', clean_filename)
         # Fallback للتوافق مع البيانات القديمة
-        return f"siteplan/بطاقة_الهوية_ID_Card{ext}"
+        return str(PurePosixPath('siteplan', 'بطاقة_الهوية_ID_Card' + ext))
     
     id_attachment = models.FileField(upload_to=get_id_attachment_path, null=True, blank=True, max_length=500)
     right_hold_type = models.CharField(max_length=120, blank=True, default="Ownership")
@@ -422,48 +546,78 @@ class SitePlanOwner(TimeStampedModel):
     # ✅ المالك المفوض (يتم اختياره صراحة من الواجهة)
     is_authorized = models.BooleanField(default=False, help_text="المالك المفوض (يتم اختياره صراحة)")
 
-    def calculate_age_from_id(self):
-        """حساب العمر من رقم الهوية الإماراتية"""
-        if not self.id_number:
-            return None
-        
-        import re
-        from datetime import date
-        
+    # ✅ ترتيب الملاك لاسم العرض: المالك المفوض أولاً ثم الأقدم
+    DISPLAY_NAME_ORDERING = ('-is_authorized', 'id')
+
+    @staticmethod
+    def display_name_from_rows(rows):
+        """
+        اسم العرض للمشروع من صفوف (is_authorized, owner_name_ar, owner_name_en) مرتبة بـ DISPLAY_NAME_ORDERING
+        المالك المفوض (أو أول مالك له اسم إذا لم يكن هناك مفوض) + "وشركاؤه" إذا كان هناك أكثر من مالك
+        """
+        main = ""
+        for is_authorized, ar, en in rows:
+            main = (ar or "").strip() or (en or "").strip()
+            if main or is_authorized:
+                break
+        if not main:
+            return ""
+        return f"{main} وشركاؤه" if len(rows) > 1 else main
+
+    @classmethod
+    def display_name_for(cls, siteplan_id):
+        """اسم العرض من ملاك SitePlan (استعلام واحد بـ values_list)"""
+        rows = list(
+            cls.objects.filter(siteplan_id=siteplan_id)
+            .order_by(*cls.DISPLAY_NAME_ORDERING)
+            .values_list('is_authorized', 'owner_name_ar', 'owner_name_en')
+        )
+        return cls.display_name_from_rows(rows)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _age_from_id_number(id_number_str, current_year):
+        """حساب العمر من رقم الهوية (مُخزَّن مؤقتاً لنفس الرقم ونفس السنة)"""
         # إزالة الفواصل والمسافات
-        cleaned = re.sub(r'[-\s]', '', str(self.id_number))
-        
+        cleaned = _ID_CLEAN_RE.sub('', id_number_str)
+
         # محاولة استخراج سنة الميلاد من التنسيق: 784-YYYY-XXXXXXX-X
         birth_year = None
-        
+
         # طريقة 1: إذا كان الرقم يحتوي على فواصل
-        if '-' in str(self.id_number):
-            parts = str(self.id_number).split('-')
+        if '-' in id_number_str:
+            parts = id_number_str.split('-')
             if len(parts) >= 2 and parts[1]:
                 try:
                     year = int(parts[1].strip())
-                    if 1900 <= year <= date.today().year:
+                    if 1900 <= year <= current_year:
                         birth_year = year
                 except (ValueError, TypeError):
                     pass
-        
+
         # طريقة 2: إذا لم نجد سنة من الفواصل، نحاول من المواضع 4-7
         if birth_year is None and len(cleaned) >= 8:
             try:
                 year = int(cleaned[3:7])
-                if 1900 <= year <= date.today().year:
+                if 1900 <= year <= current_year:
                     birth_year = year
             except (ValueError, TypeError):
                 pass
-        
+
         # حساب العمر
         if birth_year:
-            current_year = date.today().year
             age = current_year - birth_year
             return age if age >= 0 else None
-        
+
         return None
 
+    def calculate_age_from_id(self):
+        """حساب العمر من رقم الهوية الإماراتية"""
+        if not self.id_number:
+            return None
+        from datetime import date
+        return SitePlanOwner._age_from_id_number(str(self.id_number), date.today().year)
+
     def save(self, *args, **kwargs):
         """حساب العمر تلقائياً قبل الحفظ"""
         self.age = self.calculate_age_from_id()
@@ -533,6 +687,7 @@ class ProjectConsultant(TimeStampedModel):
         ('design', 'استشاري التصميم'),
         ('supervision', 'استشاري الإشراف'),
     ]
+    _ROLE_MAP = dict(ROLE_CHOICES)
     role = models.CharField(
         max_length=20,
         choices=ROLE_CHOICES,
@@ -551,7 +706,7 @@ class ProjectConsultant(TimeStampedModel):
         ]
     
     def __str__(self):
-        role_display = dict(self.ROLE_CHOICES).get(self.role, self.role)
+        role_display = self._ROLE_MAP.get(self.role, self.role)
         return f"{self.consultant.name} - {role_display} ({self.project.name or self.project.id})"
 
 
@@ -582,15 +737,12 @@ class BuildingLicense(TimeStampedModel):
         """حفظ ملف رخصة البناء في المسار المنظم للمشروع."""
         project = get_project_from_instance(instance)
         # ✅ استخدام اسم ملف ثابت: رخصة_البناء_Building_Permit
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"رخصة_البناء_Building_Permit{ext}"
+        ext = os.path.splitext(filename)[1] or '.pdf'
         if project:
             # حفظ مباشرة في Project Info- معلومات المشروع بدون subfolder
-            return get_project_file_path(project, 'project_info', clean_filename)
+            return get_project_file_path(project, 'project_info', _LICENSE_FN + ext)
         # Fallback للتوافق مع البيانات القديمة
-        project_part = instance.project_id or "project"
-        return f"licenses/{project_part}/رخصة_البناء{ext}"
+        return str(PurePosixPath('licenses', str(instance.project_id or 'project'), 'رخصة_البناء' + ext))
     
     building_license_file = models.FileField(upload_to=get_building_license_file_path, null=True, blank=True, max_length=500)
 
@@ -670,7 +822,7 @@ class BuildingLicense(TimeStampedModel):
     owners = models.JSONField(default=list, blank=True)
 
     # Read-only snapshot من SitePlan
-    siteplan_snapshot = models.JSONField(default=dict, editable=False)
+    siteplan_snapshot = models.JSONField(default=dict, editable=False, encoder=SnapshotJSONEncoder)
 
     def __str__(self):
         return f"Building License {self.license_no or self.id}"
@@ -715,7 +867,7 @@ class Contract(TimeStampedModel):
     bank_fee_extra_value = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
 
     # Snapshot
-    license_snapshot = models.JSONField(default=dict, editable=False)
+    license_snapshot = models.JSONField(default=dict, editable=False, encoder=SnapshotJSONEncoder)
     
     # بيانات الملاك (قابلة للتحرير في العقد)
     owners = models.JSONField(
@@ -730,195 +882,27 @@ class Contract(TimeStampedModel):
     # المرفقات الديناميكية
     attachments = models.JSONField(default=list, blank=True, help_text="مرفقات العقد الديناميكية")
     
-    # دوال upload_to للملفات - الهيكل الجديد الموحد
-    def get_contract_file_path(instance, filename):
-        """حفظ ملف العقد الأصيل في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: العقد_الأصيل
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"العقد_الأصيل_Original_Contract{ext}" if ext else "العقد_الأصيل_Original_Contract"
-        if project:
-            # حفظ مباشرة في مجلد contracts - العقود بدون subfolder
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_contract_appendix_file_path(instance, filename):
-        """حفظ ملف ملحق العقد في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: ملحق_عقد (بدون رقم)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"ملحق_عقد_Contract_Addendum{ext}" if ext else "ملحق_عقد_Contract_Addendum"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_contract_explanation_file_path(instance, filename):
-        """حفظ ملف توضيحات العقد في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: توضيحات_تعاقدية (بدون رقم)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"توضيحات_تعاقدية_Contract_Clarifications{ext}" if ext else "توضيحات_تعاقدية_Contract_Clarifications"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_quantities_table_file_path(instance, filename):
-        """حفظ جدول الكميات في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: جدول_الكميات_BOQ
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"جدول_الكميات_BOQ{ext}"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_approved_materials_table_file_path(instance, filename):
-        """حفظ جدول المواد المعتمدة في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: جدول_المواد_المعتمدة
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"جدول_المواد_المعتمدة_Materials_Table{ext}" if ext else "جدول_المواد_المعتمدة_Materials_Table"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_price_offer_file_path(instance, filename):
-        """حفظ عرض السعر في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: عرض_السعر
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"عرض_السعر_Price_Offer{ext}" if ext else "عرض_السعر_Price_Offer"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_mep_drawings_file_path(instance, filename):
-        """حفظ مخططات MEP في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: مخططات_MEP
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_MEP{ext}" if ext else "مخططات_MEP"
-        if project:
-            # حفظ مباشرة في مجلد contracts - العقود بدون subfolder
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_architectural_drawings_file_path(instance, filename):
-        """حفظ المخططات المعمارية في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: المخططات_المعمارية
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"المخططات_المعمارية_Architectural_Drawings{ext}" if ext else "المخططات_المعمارية_Architectural_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_structural_drawings_file_path(instance, filename):
-        """حفظ المخططات الإنشائية في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: المخططات_الإنشائية
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"المخططات_الإنشائية_Structural_Drawings{ext}" if ext else "المخططات_الإنشائية_Structural_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_ac_drawings_file_path(instance, filename):
-        """حفظ مخططات التكييف في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_التكييف_AC_Drawings{ext}" if ext else "مخططات_التكييف_AC_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_electrical_drawings_file_path(instance, filename):
-        """حفظ مخططات الكهرباء في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_الكهرباء_Electrical_Drawings{ext}" if ext else "مخططات_الكهرباء_Electrical_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_water_supply_drawings_file_path(instance, filename):
-        """حفظ مخططات إمداد المياه في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_إمداد_المياه_Water_Supply_Drawings{ext}" if ext else "مخططات_إمداد_المياه_Water_Supply_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_drainage_drawings_file_path(instance, filename):
-        """حفظ مخططات الصرف الصحي في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_الصرف_الصحي_Drainage_Drawings{ext}" if ext else "مخططات_الصرف_الصحي_Drainage_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_telecommunication_drawings_file_path(instance, filename):
-        """حفظ مخططات الاتصالات في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_الاتصالات_Telecommunication_Drawings{ext}" if ext else "مخططات_الاتصالات_Telecommunication_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_fire_fighting_drawings_file_path(instance, filename):
-        """حفظ مخططات مكافحة الحرائق في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_مكافحة_الحرائق_Fire_Fighting_Drawings{ext}" if ext else "مخططات_مكافحة_الحرائق_Fire_Fighting_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_cctv_drawings_file_path(instance, filename):
-        """حفظ مخططات كاميرات المراقبة في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_كاميرات_المراقبة_CCTV_Drawings{ext}" if ext else "مخططات_كاميرات_المراقبة_CCTV_Drawings"
-        if project:
-            return get_project_file_path(project, 'contracts', clean_filename, subfolder='مخططات_العقد')
-        return f"contracts/مخططات_العقد/{clean_filename}"
-    
-    def get_decoration_drawings_file_path(instance, filename):
-        """حفظ مخططات الديكور في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: مخططات_الديكور
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"مخططات_الديكور{ext}" if ext else "مخططات_الديكور"
-        if project:
-            # حفظ مباشرة في مجلد contracts - العقود بدون subfolder
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_contractual_drawings_file_path(instance, filename):
-        """حفظ المخططات التعاقدية (قديم) في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: المخططات_التعاقدية
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"المخططات_التعاقدية{ext}" if ext else "المخططات_التعاقدية"
-        if project:
-            # حفظ مباشرة في مجلد contracts - العقود بدون subfolder
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
-    
-    def get_general_specifications_file_path(instance, filename):
-        """حفظ المواصفات العامة والخاصة في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: المواصفات_العامة_والخاصة
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"المواصفات_العامة_والخاصة{ext}" if ext else "المواصفات_العامة_والخاصة"
-        if project:
-            # حفظ مباشرة في مجلد contracts - العقود بدون subfolder
-            return get_project_file_path(project, 'contracts', clean_filename)
-        return f"contracts/{clean_filename}"
+    # دوال upload_to للملفات - الهيكل الجديد الموحد (أسماء الخصائص محفوظة للتوافق مع migrations القديمة)
+    
+    get_contract_file_path = make_upload_to('contracts', 'العقد_الأصيل_Original_Contract')
+    get_contract_appendix_file_path = make_upload_to('contracts', 'ملحق_عقد_Contract_Addendum')
+    get_contract_explanation_file_path = make_upload_to('contracts', 'توضيحات_تعاقدية_Contract_Clarifications')
+    get_quantities_table_file_path = make_upload_to('contracts', 'جدول_الكميات_BOQ', default_ext='.pdf')
+    get_approved_materials_table_file_path = make_upload_to('contracts', 'جدول_المواد_المعتمدة_Materials_Table')
+    get_price_offer_file_path = make_upload_to('contracts', 'عرض_السعر_Price_Offer')
+    get_mep_drawings_file_path = make_upload_to('contracts', 'مخططات_MEP')
+    get_architectural_drawings_file_path = make_upload_to('contracts', 'المخططات_المعمارية_Architectural_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_structural_drawings_file_path = make_upload_to('contracts', 'المخططات_الإنشائية_Structural_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_ac_drawings_file_path = make_upload_to('contracts', 'مخططات_التكييف_AC_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_electrical_drawings_file_path = make_upload_to('contracts', 'مخططات_الكهرباء_Electrical_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_water_supply_drawings_file_path = make_upload_to('contracts', 'مخططات_إمداد_المياه_Water_Supply_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_drainage_drawings_file_path = make_upload_to('contracts', 'مخططات_الصرف_الصحي_Drainage_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_telecommunication_drawings_file_path = make_upload_to('contracts', 'مخططات_الاتصالات_Telecommunication_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_fire_fighting_drawings_file_path = make_upload_to('contracts', 'مخططات_مكافحة_الحرائق_Fire_Fighting_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_cctv_drawings_file_path = make_upload_to('contracts', 'مخططات_كاميرات_المراقبة_CCTV_Drawings', subfolder=_DRAWINGS_SUBFOLDER)
+    get_decoration_drawings_file_path = make_upload_to('contracts', 'مخططات_الديكور')
+    get_contractual_drawings_file_path = make_upload_to('contracts', 'المخططات_التعاقدية')
+    get_general_specifications_file_path = make_upload_to('contracts', 'المواصفات_العامة_والخاصة')
     
     # الملفات القديمة (للتوافق مع البيانات الموجودة)
     contract_file = models.FileField(upload_to=get_contract_file_path, null=True, blank=True, max_length=500)
@@ -948,6 +932,13 @@ class Contract(TimeStampedModel):
     def __str__(self):
         return f"Contract for {self.project.name or self.project_id}"
 
+    def save(self, *args, **kwargs):
+        # ✅ updated_at يُحدَّث دائماً حتى مع update_fields (مفتاح cache تمثيل العقد يعتمد عليه)
+        update_fields = kwargs.get('update_fields')
+        if update_fields and 'updated_at' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
+        super().save(*args, **kwargs)
+
 
 
 # ====== أمر الترسية ======
@@ -966,16 +957,7 @@ class Awarding(TimeStampedModel):
     # رقم تسجيل المقاول (VR-xxxx)
     contractor_registration_number = models.CharField(max_length=120, blank=True)
     
-    def get_awarding_file_path(instance, filename):
-        """حفظ ملف أمر الترسية في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: أمر_الترسية
-        name, ext = os.path.splitext(filename)
-        clean_filename = f"أمر_الترسية_Bank_Awarding_Letter{ext}" if ext else "أمر_الترسية_Bank_Awarding_Letter"
-        if project:
-            # حفظ مباشرة في Project Info- معلومات المشروع بدون subfolder
-            return get_project_file_path(project, 'project_info', clean_filename)
-        return f"awarding/{clean_filename}"
+    get_awarding_file_path = make_upload_to('project_info', 'أمر_الترسية_Bank_Awarding_Letter', fallback='awarding')
     
     # ملف أمر الترسية
     awarding_file = models.FileField(upload_to=get_awarding_file_path, null=True, blank=True)
@@ -994,22 +976,7 @@ class StartOrder(TimeStampedModel):
     # ملاحظات أمر المباشرة
     start_order_notes = models.TextField(blank=True, help_text="ملاحظات أمر المباشرة")
     
-    def get_start_order_file_path(instance, filename):
-        """حفظ ملف أمر المباشرة في Project Schedule– المدة الزمنية للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: أمر_المباشرة_Start_Order
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"أمر_المباشرة_Start_Order{ext}"
-        if project:
-            # حفظ في Project Schedule– المدة الزمنية للمشروع
-            # ✅ استخدام get_project_file_path مباشرة مع الاسم الكامل
-            project_folder = get_project_folder_name(project)
-            actual_folder_name = 'Project Schedule– المدة الزمنية للمشروع'
-            # ✅ بناء المسار مباشرة بدون sanitize_filename لأن الاسم نظيف بالفعل
-            file_path = f"projects/{project_folder}/{actual_folder_name}/{clean_filename}"
-            return file_path.replace('\\', '/')
-        return f"start_order/{clean_filename}"
+    get_start_order_file_path = make_upload_to('project_schedule', 'أمر_المباشرة_Start_Order', default_ext='.pdf', fallback='start_order')
     
     # ملف أمر المباشرة
     start_order_file = models.FileField(upload_to=get_start_order_file_path, null=True, blank=True, max_length=500)
@@ -1038,20 +1005,7 @@ class ProjectSchedule(TimeStampedModel):
     # تاريخ نهاية المشروع (يتم حسابه تلقائياً)
     project_end_date = models.DateField(null=True, blank=True, help_text="تاريخ نهاية المشروع (محسوب تلقائياً)")
     
-    def get_project_schedule_file_path(instance, filename):
-        """حفظ ملف الجدول الزمني في Project Schedule– المدة الزمنية للمشروع (نفس مكان أمر المباشرة)."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: الجدول_الزمني_Project_Schedule
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"الجدول_الزمني_Project_Schedule{ext}"
-        if project:
-            # حفظ في Project Schedule– المدة الزمنية للمشروع (نفس مكان أمر المباشرة)
-            project_folder = get_project_folder_name(project)
-            actual_folder_name = 'Project Schedule– المدة الزمنية للمشروع'
-            file_path = f"projects/{project_folder}/{actual_folder_name}/{clean_filename}"
-            return file_path.replace('\\', '/')
-        return f"project_schedule/{clean_filename}"
+    get_project_schedule_file_path = make_upload_to('project_schedule', 'الجدول_الزمني_Project_Schedule', default_ext='.pdf')
     
     # ملف الجدول الزمني
     schedule_file = models.FileField(upload_to=get_project_schedule_file_path, null=True, blank=True, max_length=500, help_text="ملف الجدول الزمني للمشروع")
@@ -1067,20 +1021,7 @@ class ExcavationStartNotice(TimeStampedModel):
     # تاريخ إشعار بدء الحفر
     notice_date = models.DateField(null=True, blank=True, help_text="تاريخ إشعار بدء الحفر")
     
-    def get_excavation_notice_file_path(instance, filename):
-        """حفظ ملف إشعار بدء الحفر في Project Schedule– المدة الزمنية للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف ثابت: إشعار_بدء_الحفر_Excavation_Start_Notice
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"إشعار_بدء_الحفر_Excavation_Start_Notice{ext}"
-        if project:
-            # حفظ في Project Schedule– المدة الزمنية للمشروع
-            project_folder = get_project_folder_name(project)
-            actual_folder_name = 'Project Schedule– المدة الزمنية للمشروع'
-            file_path = f"projects/{project_folder}/{actual_folder_name}/{clean_filename}"
-            return file_path.replace('\\', '/')
-        return f"excavation_notice/{clean_filename}"
+    get_excavation_notice_file_path = make_upload_to('project_schedule', 'إشعار_بدء_الحفر_Excavation_Start_Notice', default_ext='.pdf', fallback='excavation_notice')
     
     # ملف إشعار بدء الحفر
     notice_file = models.FileField(upload_to=get_excavation_notice_file_path, null=True, blank=True, max_length=500)
@@ -1103,17 +1044,8 @@ class Variation(TimeStampedModel):
     net_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'), help_text="المبلغ الصافي")
     vat = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'), help_text="الضريبة")
     net_amount_with_vat = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'), help_text="المبلغ الصافي بالضريبة")
-    def get_variation_invoice_file_path(instance, filename):
-        """حفظ فاتورة التعديل في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف موحد: فاتورة_التعديل_Variation_Invoice (بدون أرقام عشوائية)
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"فاتورة_التعديل_Variation_Invoice{ext}"
-        if project:
-            project_folder = get_project_folder_name(project)
-            return f"projects/{project_folder}/variation_orders/{clean_filename}"
-        return f"variation_orders/{clean_filename}"
+    
+    get_variation_invoice_file_path = make_upload_to('variation_orders', 'فاتورة_التعديل_Variation_Invoice', default_ext='.pdf', raw=True)
     
     variation_invoice_file = models.FileField(upload_to=get_variation_invoice_file_path, blank=True, null=True, help_text="فاتورة التعديل")
     # Legacy fields (kept for backward compatibility)
@@ -1127,6 +1059,10 @@ class Variation(TimeStampedModel):
         verbose_name = 'Price Change Order'
         verbose_name_plural = 'Price Change Orders'
         ordering = ['-approval_date', '-created_at']
+        indexes = [
+            # ✅ قائمة أوامر التغيير لمشروع بنفس ترتيب ordering (بدون sort)
+            models.Index(fields=['project', '-approval_date', '-created_at'], name='var_project_date_idx'),
+        ]
 
     def __str__(self):
         return f"Variation {self.variation_number or self.id} - {self.final_amount} for {self.project.name or self.project_id}"
@@ -1139,7 +1075,7 @@ class ActualInvoice(TimeStampedModel):
     payment = models.OneToOneField('Payment', on_delete=models.CASCADE, related_name="actual_invoice", null=True, blank=True)
     amount = models.DecimalField(max_digits=14, decimal_places=2, validators=[MinValueValidator(Decimal('0'))])
     invoice_date = models.DateField()
-    invoice_number = models.CharField(max_length=100, blank=True, unique=True, null=True)
+    invoice_number = models.CharField(max_length=100, blank=True, null=True)
     description = models.TextField(blank=True)
     items = models.JSONField(default=list, blank=True, help_text="Invoice items: [{description, quantity, unit_price, total}]")
 
@@ -1148,6 +1084,14 @@ class ActualInvoice(TimeStampedModel):
         verbose_name = 'Actual Invoice'
         verbose_name_plural = 'Actual Invoices'
         ordering = ['-invoice_date', '-created_at']
+        constraints = [
+            # ✅ unique جزئي: الفواتير بدون رقم لا تدخل الفهرس
+            models.UniqueConstraint(
+                fields=['invoice_number'],
+                condition=models.Q(invoice_number__isnull=False),
+                name='uniq_invoice_number_notnull',
+            ),
+        ]
 
     def __str__(self):
         return f"Actual Invoice {self.invoice_number or self.id} - {self.amount}"
@@ -1159,6 +1103,7 @@ class Payment(TimeStampedModel):
         ('bank', 'Bank'),
         ('owner', 'Owner'),
     ]
+    _PAYER_MAP = dict(PAYER_CHOICES)
     
     PAYMENT_METHOD_CHOICES = [
         ('cash_deposit', 'Cash Deposit in Company Bank Account'),
@@ -1184,52 +1129,11 @@ class Payment(TimeStampedModel):
     # Bank payment specific fields
     project_financial_account = models.CharField(max_length=100, blank=True, help_text="رقم الحساب المالي للمشروع (يبدأ بـ PRJ)")
     completion_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, help_text="نسبة الإنجاز")
-    def get_bank_payment_attachments_path(instance, filename):
-        """حفظ مرفقات دفعة البنك في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف موحد: مرفقات_دفعة_البنك_Bank_Payment_Attachments (بدون أرقام عشوائية)
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"مرفقات_دفعة_البنك_Bank_Payment_Attachments{ext}"
-        if project:
-            return get_project_file_path(project, 'payments', clean_filename, subfolder='bank_attachments')
-        return f"payments/bank_attachments/{clean_filename}"
-    
-    def get_deposit_slip_path(instance, filename):
-        """حفظ إيصال الإيداع في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف موحد: إيصال_الإيداع_Deposit_Slip (بدون أرقام عشوائية)
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"إيصال_الإيداع_Deposit_Slip{ext}"
-        if project:
-            project_folder = get_project_folder_name(project)
-            return f"projects/{project_folder}/payments/payments/{clean_filename}"
-        return f"payments/payments/{clean_filename}"
     
-    def get_payment_invoice_file_path(instance, filename):
-        """حفظ فاتورة الدفع في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف موحد: فاتورة_الدفع_Payment_Invoice (بدون أرقام عشوائية)
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"فاتورة_الدفع_Payment_Invoice{ext}"
-        if project:
-            project_folder = get_project_folder_name(project)
-            return f"projects/{project_folder}/invoices/invoices/{clean_filename}"
-        return f"invoices/invoices/{clean_filename}"
-    
-    def get_receipt_voucher_path(instance, filename):
-        """حفظ سند القبض (إيصال الاستلام) في المسار المنظم للمشروع."""
-        project = get_project_from_instance(instance)
-        # ✅ استخدام اسم ملف موحد: سند_القبض_Receipt_Voucher (بدون أرقام عشوائية)
-        name, ext = os.path.splitext(filename)
-        ext = ext or '.pdf'
-        clean_filename = f"سند_القبض_Receipt_Voucher{ext}"
-        if project:
-            project_folder = get_project_folder_name(project)
-            return f"projects/{project_folder}/invoices/receipts/{clean_filename}"
-        return f"invoices/receipts/{clean_filename}"
+    get_bank_payment_attachments_path = make_upload_to('payments', 'مرفقات_دفعة_البنك_Bank_Payment_Attachments', subfolder='bank_attachments', default_ext='.pdf')
+    get_deposit_slip_path = make_upload_to('payments', 'إيصال_الإيداع_Deposit_Slip', subfolder='payments', default_ext='.pdf', raw=True)
+    get_payment_invoice_file_path = make_upload_to('invoices', 'فاتورة_الدفع_Payment_Invoice', subfolder='invoices', default_ext='.pdf', raw=True)
+    get_receipt_voucher_path = make_upload_to('invoices', 'سند_القبض_Receipt_Voucher', subfolder='receipts', default_ext='.pdf', raw=True)
     
     bank_payment_attachments = models.FileField(upload_to=get_bank_payment_attachments_path, blank=True, null=True, help_text="مرفقات دفعة البنك")
     # File attachments
@@ -1243,13 +1147,24 @@ class Payment(TimeStampedModel):
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-date', '-created_at']
+        indexes = [
+            # ✅ قائمة الدفعات لمشروع بنفس ترتيب ordering (بدون sort)
+            models.Index(fields=['project', '-date', '-created_at'], name='payment_project_date_idx'),
+            # ✅ قائمة دفعات الشركة (tenant) وقائمة superuser بنفس ترتيب ordering
+            models.Index(fields=['tenant', '-date', '-created_at'], name='payment_tenant_date_idx'),
+            models.Index(fields=['-date', '-created_at'], name='payment_date_created_idx'),
+            # ✅ مجاميع الدفعات لكل مشروع حسب الدافع (bank/owner)
+            models.Index(fields=['project', 'payer'], name='payment_project_payer_idx'),
+        ]
 
     def __str__(self):
-        payer_name = dict(self.PAYER_CHOICES).get(self.payer, self.payer)
+        payer_name = self._PAYER_MAP.get(self.payer, self.payer)
         if self.project:
             return f"{payer_name} Payment {self.amount} for {self.project.name or self.project_id} on {self.date}"
         return f"{payer_name} Payment {self.amount} on {self.date}"
 
+    OWNER_VALID_METHODS = frozenset({'cash_deposit', 'cash_office', 'bank_transfer', 'bank_cheque'})
+
     def clean(self):
         """Validate payment method based on payer"""
         from django.core.exceptions import ValidationError
@@ -1264,7 +1179,7 @@ class Payment(TimeStampedModel):
                 raise ValidationError({
                     'payment_method': 'Payment method is required for owner payments.'
                 })
-            if self.payment_method not in ['cash_deposit', 'cash_office', 'bank_transfer', 'bank_cheque']:
+            if self.payment_method not in self.OWNER_VALID_METHODS:
                 raise ValidationError({
                     'payment_method': 'Invalid payment method for owner payments.'
                 })
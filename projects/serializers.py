@@ -1,16 +1,31 @@
 import re
 import json
+import functools
+import hashlib
 import logging
-from datetime import timedelta
-from django.db import models
+import operator
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from django.db import models, transaction
 from django.conf import settings
-from django.core.files.storage import default_storage
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
 from rest_framework import serializers
+
+try:
+    import orjson
+except ImportError:  # orjson اختياري - الرجوع إلى json القياسي
+    orjson = None
+
 from .models import (
     Project, SitePlan, SitePlanOwner, BuildingLicense, Contract, Awarding, StartOrder, Payment,
-    Variation, ActualInvoice, Consultant, ProjectConsultant, ProjectSchedule, ExcavationStartNotice
+    Variation, ActualInvoice, Consultant, ProjectConsultant, ProjectSchedule, ExcavationStartNotice,
+    SnapshotJSONEncoder,
 )
-from .utils import save_project_file, get_project_file_path
+from authentication.models import TenantSettings
+from .utils import save_project_file, get_project_file_path, invalidate_project_folder_name, on_commit_once
 
 # Import WorkflowStage for serializer
 try:
@@ -20,6 +35,9 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# ✅ تحليل JSON للملاك (قد يكون نصاً كبيراً في نماذج متعددة الملاك) - orjson إذا كان مثبتاً
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 # =========================
 # Helper Functions - Unified File URL Handling
 # =========================
@@ -39,17 +57,48 @@ def get_file_name(file_field):
     
     try:
         # ✅ الحصول على اسم الملف من file_field.name
-        if hasattr(file_field, 'name') and file_field.name:
+        name = getattr(file_field, 'name', None)
+        if name:
             # ✅ استخراج اسم الملف فقط (بدون المسار)
             import os
-            file_name = os.path.basename(file_field.name)
-            return file_name
+            return os.path.basename(name)
     except Exception as e:
         logger.warning(f"Error getting file name: {e}", exc_info=True)
     
     return None
 
 
+# ✅ مدة تخزين روابط الـ storage البعيد (أقل بكثير من صلاحية روابط S3 الموقعة - ساعة افتراضياً)
+FILE_URL_CACHE_TIMEOUT = 300
+# ✅ أقل صلاحية متبقية مضمونة للرابط الموقّع عند وصوله للعميل
+SIGNED_URL_MIN_VALIDITY = 1800
+
+
+def url_payload_cache_timeout(timeout, storage=default_storage):
+    """
+    مدة تخزين أي بيانات تحتوي روابط من cached_storage_url (لقطات/تمثيلات)
+    ✅ للروابط الموقّعة: صلاحية الرابط - عمره الأقصى في FILE_URL_CACHE_TIMEOUT - SIGNED_URL_MIN_VALIDITY
+    يرجع 0 إذا لم يتبقَّ وقت كافٍ (لا يتم التخزين)
+    """
+    if isinstance(storage, FileSystemStorage) or not getattr(storage, 'querystring_auth', False):
+        return timeout
+    expire = getattr(storage, 'querystring_expire', None) or getattr(settings, 'AWS_QUERYSTRING_EXPIRE', 3600)
+    return max(0, min(timeout, expire - FILE_URL_CACHE_TIMEOUT - SIGNED_URL_MIN_VALIDITY))
+
+
+def cached_storage_url(storage, name):
+    """
+    storage.url(name) مع cache قصير للـ storage البعيد (S3 يوقّع الرابط عند كل استدعاء)
+    FileSystemStorage رخيص - بدون cache
+    """
+    if not name:
+        raise ValueError("The file has no name.")
+    if isinstance(storage, FileSystemStorage):
+        return storage.url(name)
+    key = f"file_url:{hashlib.sha1(name.encode()).hexdigest()}"
+    return cache.get_or_set(key, lambda: storage.url(name), FILE_URL_CACHE_TIMEOUT)
+
+
 def get_file_url(file_field, request=None):
     """
     دالة موحدة لإرجاع URL الملف بشكل متسق
@@ -69,22 +118,17 @@ def get_file_url(file_field, request=None):
         # ✅ الحصول على URL من Django storage
         url = None
         
-        # ✅ محاولة الحصول على URL بأمان
-        if hasattr(file_field, 'url'):
-            try:
-                url = file_field.url
-            except (ValueError, AttributeError):
-                # إذا فشل url، نحاول استخدام name
-                if hasattr(file_field, 'name') and file_field.name:
-                    try:
-                        url = default_storage.url(file_field.name)
-                    except Exception:
-                        pass
+        # ✅ محاولة الحصول على URL بأمان (EAFP: نفس FieldFile.url لكن عبر cache للـ storage البعيد)
+        try:
+            url = cached_storage_url(file_field.storage, file_field.name)
+        except (ValueError, AttributeError):
+            pass
         
         # ✅ إذا لم نحصل على URL من url، نحاول name
-        if not url and hasattr(file_field, 'name') and file_field.name:
+        name = getattr(file_field, 'name', None)
+        if not url and name:
             try:
-                url = default_storage.url(file_field.name)
+                url = default_storage.url(name)
             except Exception:
                 pass
         
@@ -163,67 +207,121 @@ def normalize_file_url(url):
 # =========================
 # Helpers (snapshots)
 # =========================
-def build_siteplan_snapshot(sp: SitePlan):
-    """إنشاء لقطة ثابتة من الـ SitePlan (بما فيها الملاك والملفات)."""
+_SNAPSHOT_OWNER_FIELDS = (
+    "owner_name_ar", "owner_name_en", "nationality", "phone", "email", "id_number",
+    "id_issue_date", "id_expiry_date", "share_possession", "right_hold_type",
+    "share_percent", "id_attachment", "age", "is_authorized",
+)
+
+
+def _flt(x):
+    return float(x) if x is not None else None
+
+
+def _as_stored_json(value):
+    """القيمة كما تُقرأ من JSONField بعد الحفظ (تواريخ كنصوص ISO) - للمقارنة مع المخزن قبل الكتابة"""
+    return _json_loads(SnapshotJSONEncoder().encode(value))
+
+
+def _delete_stored_files(names, storage=default_storage):
+    """حذف ملفات قديمة من storage (بعد نجاح الـ transaction) - فشل حذف ملف لا يوقف الباقي"""
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.warning("Could not delete stale file %s", name, exc_info=True)
+
+
+def _date_str(value):
+    """تاريخ الهوية كنص ISO - قد يكون date (من قاعدة البيانات) أو نصاً (قيمة الطلب في الذاكرة)"""
+    if not value:
+        return ""
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _safe_url(name):
+    """URL موحد لملف مخزن بالاسم - الجزء الوحيد الذي قد يفشل (إعدادات storage)"""
+    if not name:
+        return None
+    try:
+        return get_file_url(cached_storage_url(default_storage, name))
+    except Exception as e:
+        logger.warning(f"Error building file URL for {name}: {e}")
+        return None
+
+
+# ✅ الحقول التي تُنسخ إلى BuildingLicense.owners عند تحديث الملاك (بنفس الترتيب)
+_LICENSE_OWNER_FIELDS = (
+    "owner_name_ar", "owner_name_en", "nationality", "phone", "email",
+    "id_number", "id_issue_date", "id_expiry_date", "right_hold_type", "share_possession",
+    "share_percent", "age", "is_authorized",
+)
+
+
+def _license_owner_row(row):
+    """dict مالك واحد لـ BuildingLicense.owners (تواريخ ISO ونسبة الحصة كنص)"""
+    row["id_issue_date"] = _date_str(row["id_issue_date"])
+    row["id_expiry_date"] = _date_str(row["id_expiry_date"])
+    share_percent = row["share_percent"]
+    row["share_percent"] = str(share_percent) if share_percent is not None else "100.00"
+    return row
+
+
+def build_siteplan_snapshot(sp: SitePlan, context=None):
+    """
+    إنشاء لقطة ثابتة من الـ SitePlan (بما فيها الملاك والملفات).
+    ✅ context: memo لنفس الطلب (serializer context) بمفتاح (pk, updated_at) - بدون cache مشترك
+    """
+    updated_at = getattr(sp, 'updated_at', None)
+    if context is None or not sp.pk or not updated_at:
+        return _build_siteplan_snapshot(sp)
+    memo = context.setdefault('_siteplan_snapshots', {})
+    key = (sp.pk, updated_at)
+    snapshot = memo.get(key)
+    if snapshot is None:
+        snapshot = memo[key] = _build_siteplan_snapshot(sp)
+    return snapshot
+
+
+def _build_siteplan_snapshot(sp: SitePlan):
     owners = []
     try:
-        for o in sp.owners.all().order_by("id"):
-            try:
-                # ✅ استخدام الدالة الموحدة للحصول على URL
-                id_attachment_url = get_file_url(getattr(o, 'id_attachment', None))
-                
-                owner_data = {
-                    "owner_name_ar": getattr(o, 'owner_name_ar', ''),
-                    "owner_name_en": getattr(o, 'owner_name_en', ''),
-                    "nationality": getattr(o, 'nationality', ''),
-                    "phone": getattr(o, 'phone', ''),
-                    "email": getattr(o, 'email', ''),
-                    "id_number": getattr(o, 'id_number', ''),
-                    "id_issue_date": o.id_issue_date.isoformat() if hasattr(o, 'id_issue_date') and o.id_issue_date else None,
-                    "id_expiry_date": o.id_expiry_date.isoformat() if hasattr(o, 'id_expiry_date') and o.id_expiry_date else None,
-                    "share_possession": getattr(o, 'share_possession', ''),
-                    "right_hold_type": getattr(o, 'right_hold_type', 'Ownership'),
-                    "share_percent": float(o.share_percent) if hasattr(o, 'share_percent') and o.share_percent is not None else None,
-                    "id_attachment": id_attachment_url,
-                    "age": getattr(o, 'age', None) if hasattr(o, 'age') else None,  # ✅ العمر المحسوب تلقائياً
-                    "is_authorized": getattr(o, 'is_authorized', False) if hasattr(o, 'is_authorized') else False,  # ✅ المالك المفوض
-                }
-                owners.append(owner_data)
-            except Exception as e:
-                logger.warning(f"Error building snapshot for owner {getattr(o, 'id', 'unknown')}: {e}")
-                # ✅ تخطي المالك الذي به خطأ والمتابعة
-                continue
+        # ✅ values() ترجع dicts مباشرة بدون إنشاء كائنات SitePlanOwner
+        for o in sp.owners.order_by("id").values(*_SNAPSHOT_OWNER_FIELDS):
+            o["share_percent"] = _flt(o["share_percent"])
+            o["id_attachment"] = _safe_url(o["id_attachment"])
+            owners.append(o)
     except Exception as e:
         logger.error(f"Error building owners snapshot for SitePlan {getattr(sp, 'id', 'unknown')}: {e}", exc_info=True)
         owners = []  # ✅ قائمة فارغة في حالة الخطأ
     # ✅ استخدام الدالة الموحدة للحصول على URL
-    application_file_url = get_file_url(getattr(sp, 'application_file', None))
+    application_file_url = get_file_url(sp.application_file)
     
     return {
         "property": {
-            "municipality": getattr(sp, 'municipality', ''),
-            "zone": getattr(sp, 'zone', ''),
-            "sector": getattr(sp, 'sector', ''),
-            "road_name": getattr(sp, 'road_name', ''),
-            "plot_area_sqm": float(sp.plot_area_sqm) if hasattr(sp, 'plot_area_sqm') and sp.plot_area_sqm is not None else None,
-            "plot_area_sqft": float(sp.plot_area_sqft) if hasattr(sp, 'plot_area_sqft') and sp.plot_area_sqft is not None else None,
-            "land_no": getattr(sp, 'land_no', ''),
-            "plot_address": getattr(sp, 'plot_address', ''),
-            "construction_status": getattr(sp, 'construction_status', ''),
-            "allocation_type": getattr(sp, 'allocation_type', ''),
-            "land_use": getattr(sp, 'land_use', ''),
-            "base_district": getattr(sp, 'base_district', ''),
-            "overlay_district": getattr(sp, 'overlay_district', ''),
-            "allocation_date": sp.allocation_date.isoformat() if hasattr(sp, 'allocation_date') and sp.allocation_date else None,
+            "municipality": sp.municipality,
+            "zone": sp.zone,
+            "sector": sp.sector,
+            "road_name": sp.road_name,
+            "plot_area_sqm": _flt(sp.plot_area_sqm),
+            "plot_area_sqft": _flt(sp.plot_area_sqft),
+            "land_no": sp.land_no,
+            "plot_address": sp.plot_address,
+            "construction_status": sp.construction_status,
+            "allocation_type": sp.allocation_type,
+            "land_use": sp.land_use,
+            "base_district": sp.base_district,
+            "overlay_district": sp.overlay_district,
+            "allocation_date": sp.allocation_date,
         },
         "developer": {
-            "developer_name": getattr(sp, 'developer_name', ''),
-            "project_no": getattr(sp, 'project_no', ''),
-            "project_name": getattr(sp, 'project_name', ''),
+            "developer_name": sp.developer_name,
+            "project_no": sp.project_no,
+            "project_name": sp.project_name,
         },
         "application": {
-            "application_number": getattr(sp, 'application_number', ''),
-            "application_date": sp.application_date.isoformat() if hasattr(sp, 'application_date') and sp.application_date else None,
+            "application_number": sp.application_number,
+            "application_date": sp.application_date,
             "application_file": application_file_url,
         },
         "owners": owners,
@@ -234,50 +332,48 @@ def build_license_snapshot(lic: BuildingLicense):
     """إنشاء لقطة ثابتة من الـ License تُحفظ داخل Contract.license_snapshot"""
     try:
         return {
-        "license": {
-            "license_type": getattr(lic, "license_type", ""),
-            "project_no": getattr(lic, "project_no", ""),
-            "project_name": getattr(lic, "project_name", ""),
-            "license_project_no": getattr(lic, "license_project_no", ""),
-            "license_project_name": getattr(lic, "license_project_name", ""),
-            "license_no": getattr(lic, "license_no", ""),
-            "issue_date": lic.issue_date.isoformat() if getattr(lic, "issue_date", None) else None,
-            "last_issue_date": lic.last_issue_date.isoformat() if getattr(lic, "last_issue_date", None) else None,
-            "expiry_date": lic.expiry_date.isoformat() if getattr(lic, "expiry_date", None) else None,
-            "technical_decision_ref": getattr(lic, "technical_decision_ref", ""),
-            "technical_decision_date": lic.technical_decision_date.isoformat() if getattr(lic, "technical_decision_date", None) else None,
-            "license_notes": getattr(lic, "license_notes", ""),
-            "building_license_file": get_file_url(getattr(lic, "building_license_file", None)),
-        },
-        "land": {
-            "city": getattr(lic, "city", ""),
-            "zone": getattr(lic, "zone", ""),
-            "sector": getattr(lic, "sector", ""),
-            "plot_no": getattr(lic, "plot_no", ""),
-            "plot_address": getattr(lic, "plot_address", ""),
-            "plot_area_sqm": float(lic.plot_area_sqm) if getattr(lic, "plot_area_sqm", None) is not None else None,
-            "land_use": getattr(lic, "land_use", ""),
-            "land_use_sub": getattr(lic, "land_use_sub", ""),
-            "land_plan_no": getattr(lic, "land_plan_no", ""),
-        },
-        "parties": {
-            "consultant_same": getattr(lic, "consultant_same", True),
-            "design_consultant_name": getattr(lic, "design_consultant_name", ""),
-            "design_consultant_license_no": getattr(lic, "design_consultant_license_no", ""),
-            "supervision_consultant_name": getattr(lic, "supervision_consultant_name", ""),
-            "supervision_consultant_license_no": getattr(lic, "supervision_consultant_license_no", ""),
-
-            "contractor_name": getattr(lic, "contractor_name", ""),
-            "contractor_license_no": getattr(lic, "contractor_license_no", ""),
-        },
-
-        "siteplan_snapshot": getattr(lic, "siteplan_snapshot", {}) or {},
-        "owners": getattr(lic, "owners", []),
-    }
+            "license": {
+                "license_type": lic.license_type,
+                "project_no": lic.project_no,
+                "project_name": lic.project_name,
+                "license_project_no": lic.license_project_no,
+                "license_project_name": lic.license_project_name,
+                "license_no": lic.license_no,
+                "issue_date": lic.issue_date,
+                "last_issue_date": lic.last_issue_date,
+                "expiry_date": lic.expiry_date,
+                "technical_decision_ref": lic.technical_decision_ref,
+                "technical_decision_date": lic.technical_decision_date,
+                "license_notes": lic.license_notes,
+                "building_license_file": get_file_url(lic.building_license_file),
+            },
+            "land": {
+                "city": lic.city,
+                "zone": lic.zone,
+                "sector": lic.sector,
+                "plot_no": lic.plot_no,
+                "plot_address": lic.plot_address,
+                "plot_area_sqm": _flt(lic.plot_area_sqm),
+                "land_use": lic.land_use,
+                "land_use_sub": lic.land_use_sub,
+                "land_plan_no": lic.land_plan_no,
+            },
+            "parties": {
+                "consultant_same": lic.consultant_same,
+                "design_consultant_name": lic.design_consultant_name,
+                "design_consultant_license_no": lic.design_consultant_license_no,
+                "supervision_consultant_name": lic.supervision_consultant_name,
+                "supervision_consultant_license_no": lic.supervision_consultant_license_no,
+
+                "contractor_name": lic.contractor_name,
+                "contractor_license_no": lic.contractor_license_no,
+            },
+
+            "siteplan_snapshot": lic.siteplan_snapshot or {},
+            "owners": lic.owners,
+        }
     except Exception as e:
         # ✅ في حالة أي خطأ، نرجع snapshot فارغ
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error building license snapshot: {e}", exc_info=True)
         return {}
 
@@ -285,11 +381,14 @@ def build_license_snapshot(lic: BuildingLicense):
 # =========================
 # Project
 # =========================
-class ProjectSerializer(serializers.ModelSerializer):
-    has_siteplan = serializers.ReadOnlyField()
-    has_license  = serializers.ReadOnlyField()
-    completion   = serializers.ReadOnlyField()
+class WorkflowStageMiniSerializer(serializers.ModelSerializer):
+    """تمثيل مختصر لمرحلة سير العمل داخل المشروع (يعتمد على select_related('current_stage'))"""
+    class Meta:
+        model = WorkflowStage
+        fields = ('id', 'code', 'name', 'name_en')
+
 
+class ProjectSerializer(serializers.ModelSerializer):
     # الكود الداخلي: M + أرقام، مع شرط أن يكون آخر رقم فردياً (1,3,5,7,9)
     internal_code = serializers.CharField(required=False, allow_blank=True, max_length=40)
 
@@ -297,7 +396,7 @@ class ProjectSerializer(serializers.ModelSerializer):
     display_name = serializers.SerializerMethodField()
     
     # Workflow fields
-    current_stage = serializers.SerializerMethodField()
+    current_stage = WorkflowStageMiniSerializer(read_only=True)
     current_stage_id = serializers.PrimaryKeyRelatedField(
         queryset=WorkflowStage.objects.filter(is_active=True) if WorkflowStage else None,
         source='current_stage',
@@ -305,7 +404,6 @@ class ProjectSerializer(serializers.ModelSerializer):
         required=False,
         allow_null=True
     )
-    approval_status = serializers.CharField(read_only=True)
     delete_requested_by = serializers.SerializerMethodField()
     delete_approved_by = serializers.SerializerMethodField()
     last_approved_by = serializers.SerializerMethodField()
@@ -321,9 +419,7 @@ class ProjectSerializer(serializers.ModelSerializer):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # تعيين queryset للـ current_stage_id
-        if WorkflowStage and 'current_stage_id' in self.fields:
-            self.fields['current_stage_id'].queryset = WorkflowStage.objects.filter(is_active=True)
+        # ✅ queryset الخاص بـ current_stage_id معرّف على الحقل نفسه (RelatedField.get_queryset يستدعي .all() عند كل استخدام)
         
         # ✅ إظهار fields المطلوبة فقط عند استخدام include parameter
         request = self.context.get('request')
@@ -413,66 +509,39 @@ class ProjectSerializer(serializers.ModelSerializer):
             logger.warning(f"Error getting start_order_data for project {obj.id}: {e}")
         return None
     
-    def get_current_stage(self, obj):
+    def _user_dict(self, obj, attr):
+        """
+        تمثيل مختصر لمستخدم مرتبط بالمشروع (id/email/full_name)
+        ✅ نفس المستخدم يتكرر عبر المشاريع - التمثيل مخزن حسب user id طوال عمر الـ serializer
+        """
         try:
-            if obj.current_stage:
-                return {
-                    'id': obj.current_stage.id,
-                    'code': getattr(obj.current_stage, 'code', None),
-                    'name': getattr(obj.current_stage, 'name', None),
-                    'name_en': getattr(obj.current_stage, 'name_en', None),
+            user = getattr(obj, attr)
+            if not user:
+                return None
+            memo = self.__dict__.setdefault('_user_dicts', {})
+            data = memo.get(user.pk)
+            if data is None:
+                data = memo[user.pk] = {
+                    'id': user.id,
+                    'email': getattr(user, 'email', ''),
+                    'full_name': user.get_full_name() if hasattr(user, 'get_full_name') else '',
                 }
+            return data
         except Exception as e:
-            logger.warning(f"Error getting current_stage for project {obj.id}: {e}")
+            logger.warning(f"Error getting {attr} for project {obj.id}: {e}")
         return None
     
     def get_delete_requested_by(self, obj):
-        try:
-            if obj.delete_requested_by:
-                return {
-                    'id': obj.delete_requested_by.id,
-                    'email': getattr(obj.delete_requested_by, 'email', ''),
-                    'full_name': obj.delete_requested_by.get_full_name() if hasattr(obj.delete_requested_by, 'get_full_name') else '',
-                }
-        except Exception as e:
-            logger.warning(f"Error getting delete_requested_by for project {obj.id}: {e}")
-        return None
+        return self._user_dict(obj, 'delete_requested_by')
     
     def get_delete_approved_by(self, obj):
-        try:
-            if obj.delete_approved_by:
-                return {
-                    'id': obj.delete_approved_by.id,
-                    'email': getattr(obj.delete_approved_by, 'email', ''),
-                    'full_name': obj.delete_approved_by.get_full_name() if hasattr(obj.delete_approved_by, 'get_full_name') else '',
-                }
-        except Exception as e:
-            logger.warning(f"Error getting delete_approved_by for project {obj.id}: {e}")
-        return None
+        return self._user_dict(obj, 'delete_approved_by')
     
     def get_last_approved_by(self, obj):
-        try:
-            if obj.last_approved_by:
-                return {
-                    'id': obj.last_approved_by.id,
-                    'email': getattr(obj.last_approved_by, 'email', ''),
-                    'full_name': obj.last_approved_by.get_full_name() if hasattr(obj.last_approved_by, 'get_full_name') else '',
-                }
-        except Exception as e:
-            logger.warning(f"Error getting last_approved_by for project {obj.id}: {e}")
-        return None
+        return self._user_dict(obj, 'last_approved_by')
     
     def get_final_approved_by(self, obj):
-        try:
-            if obj.final_approved_by:
-                return {
-                    'id': obj.final_approved_by.id,
-                    'email': getattr(obj.final_approved_by, 'email', ''),
-                    'full_name': obj.final_approved_by.get_full_name() if hasattr(obj.final_approved_by, 'get_full_name') else '',
-                }
-        except Exception as e:
-            logger.warning(f"Error getting final_approved_by for project {obj.id}: {e}")
-        return None
+        return self._user_dict(obj, 'final_approved_by')
 
     class Meta:
         model  = Project
@@ -491,6 +560,14 @@ class ProjectSerializer(serializers.ModelSerializer):
             # ✅ Fields للبيانات المطلوبة عند استخدام include parameter
             "siteplan_data", "license_data", "contract_data", "awarding_data", "start_order_data",
         ]
+        # ✅ حقول القراءة فقط تُستنتج من الموديل (الـ properties تصبح ReadOnlyField تلقائياً)
+        # حقول الموافقة/الحذف تُحدَّث فقط عبر actions الخاصة بها في ProjectViewSet
+        read_only_fields = (
+            "approval_status",
+            "delete_requested_at", "delete_approved_at", "last_approved_at", "approval_notes",
+            "created_at", "updated_at",
+            "has_siteplan", "has_license", "completion",
+        )
         extra_kwargs = {
             "name": {"required": False, "allow_blank": True},
             "project_type": {"required": False},
@@ -509,8 +586,8 @@ class ProjectSerializer(serializers.ModelSerializer):
         if value in (None, ""):
             return value
 
-        # استخراج الأرقام فقط
-        digits = re.sub(r"[^0-9]", "", value or "")
+        # استخراج الأرقام فقط (ASCII 0-9 - isdigit() تقبل أرقاماً عربية/يونيكود أيضاً)
+        digits = "".join(ch for ch in value if "0" <= ch <= "9")
         if not digits:
             raise serializers.ValidationError("Internal code must contain at least one digit.")
 
@@ -550,86 +627,106 @@ class ProjectSerializer(serializers.ModelSerializer):
         return normalized
 
     def get_display_name(self, obj):
-        # نكوّن الاسم من المالك المفوض في الـ SitePlan، ولو أكثر من مالك نضيف "وشركاؤه"
-        # ✅ إذا كان obj.name موجوداً، نستخدمه أولاً (هذا هو الاسم المحفوظ من الملاك)
-        try:
-            if obj.name and obj.name.strip():
-                return obj.name
-            
-            # ✅ إذا لم يكن هناك اسم محفوظ، نحاول حسابه من الملاك
-            # ✅ استخدام prefetched data لتجنب queries إضافية
-            sp = None
-            try:
-                # ✅ محاولة الوصول إلى siteplan من prefetched data
-                if hasattr(obj, '_prefetched_objects_cache') and 'siteplan' in obj._prefetched_objects_cache:
-                    sp = obj._prefetched_objects_cache['siteplan']
-                elif hasattr(obj, 'siteplan'):
-                    # ✅ إذا كان siteplan محملاً بالفعل (select_related)
-                    sp = obj.siteplan
-            except (SitePlan.DoesNotExist, AttributeError):
-                sp = None
-            except Exception as e:
-                logger.warning(f"Error accessing siteplan for project {obj.id}: {e}")
-                sp = None
-
-            main_name = ""
-            owners_count = 0
-            if sp:
-                try:
-                    # ✅ استخدام prefetched owners إذا كانت متاحة
-                    if hasattr(sp, '_prefetched_objects_cache') and 'owners' in sp._prefetched_objects_cache:
-                        owners_list = sp._prefetched_objects_cache['owners']
-                        owners_count = len(owners_list)
-                    elif hasattr(sp, 'owners'):
-                        # ✅ إذا كان owners محملاً بالفعل (prefetch_related)
-                        owners_list = list(sp.owners.all())
-                        owners_count = len(owners_list)
-                    else:
-                        # ✅ Fallback: query مباشر (يجب ألا يحدث إذا كان prefetch_related يعمل)
-                        owners_list = list(sp.owners.all())
-                        owners_count = len(owners_list)
-                    
-                    # ✅ البحث عن المالك المفوض أولاً
-                    authorized_owner = None
-                    for o in owners_list:
-                        if getattr(o, 'is_authorized', False):
-                            authorized_owner = o
-                            break
-                    
-                    if authorized_owner:
-                        ar = (getattr(authorized_owner, 'owner_name_ar', None) or "").strip()
-                        en = (getattr(authorized_owner, 'owner_name_en', None) or "").strip()
-                        main_name = ar or en
-                    else:
-                        # ✅ إذا لم يكن هناك مالك مفوض محدد، نستخدم الأول
-                        for o in owners_list:
-                            ar = (getattr(o, 'owner_name_ar', None) or "").strip()
-                            en = (getattr(o, 'owner_name_en', None) or "").strip()
-                            if ar or en:
-                                main_name = ar or en
-                                break
-                except Exception as e:
-                    logger.warning(f"Error getting owners for project {obj.id}: {e}")
-
-            if main_name:
-                return f"{main_name} وشركاؤه" if owners_count > 1 else main_name
-            
-            # ✅ إذا لم يكن هناك اسم ولا ملاك، نستخدم ID أو نص افتراضي
-            project_id = getattr(obj, 'id', None)
-            if project_id:
-                return f"مشروع #{project_id}"
-            return "مشروع جديد"
-        except Exception as e:
-            logger.error(f"Error in get_display_name for project {getattr(obj, 'id', 'unknown')}: {e}", exc_info=True)
-            # ✅ إرجاع اسم افتراضي في حالة الخطأ
-            project_id = getattr(obj, 'id', None)
-            if project_id:
-                return f"مشروع #{project_id}"
-            return "مشروع جديد"
+        # ✅ اسم العرض مخزن في Project.name عند تغيّر الملاك (المالك المفوض + "وشركاؤه")
+        # المشاريع القديمة: python manage.py recompute_display_names
+        if obj.name and obj.name.strip():
+            return obj.name
+        if obj.id:
+            return f"مشروع #{obj.id}"
+        return "مشروع جديد"
 
 # =========================
 # SitePlan + Owners
 # =========================
+# ✅ تمثيل احتياطي (في حالة خطأ to_representation) - قراءة مباشرة لحقول الموديل
+# attrgetter يقرأ كل الحقول في استدعاء واحد، والقيم الثابتة مجهزة مسبقاً وتُدمج بـ |
+_OWNER_FALLBACK_FIELDS = (
+    "id", "owner_name_ar", "owner_name_en", "nationality", "phone", "email", "id_number",
+    "right_hold_type", "share_possession", "age", "is_authorized",
+)
+_SITEPLAN_FALLBACK_FIELDS = (
+    "id", "municipality", "zone", "sector", "land_no", "allocation_type", "land_use", "application_number",
+)
+# ✅ تحويل قيم boolean القادمة من FormData/JSON - بحث واحد حسب النوع بدل سلسلة isinstance
+_TRUE_STRINGS = frozenset(("true", "1", "yes", "on"))
+_BOOL_COERCE = {
+    bool: lambda v: v,
+    str: lambda v: v.lower() in _TRUE_STRINGS,
+    type(None): lambda v: False,
+}
+_DEFAULT_SHARE_PERCENT = Decimal("100.00")
+
+
+def _parse_bool(value):
+    return _BOOL_COERCE.get(type(value), bool)(value)
+
+
+def _parse_date(value):
+    """تاريخ من نص ISO (يقبل لاحقة Z) - القيم غير النصية تُعاد كما هي، والنص غير الصالح → None"""
+    if not value:
+        return None
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).date()
+    except ValueError:
+        return None
+
+
+def _parse_decimal(value, default=_DEFAULT_SHARE_PERCENT):
+    """Decimal من نص/رقم - القيمة الفارغة أو غير الصالحة → default"""
+    if isinstance(value, Decimal):
+        return value
+    if value is None or value == "":
+        return default
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return default
+
+
+_owner_fallback_values = operator.attrgetter(*_OWNER_FALLBACK_FIELDS)
+_siteplan_fallback_values = operator.attrgetter(*_SITEPLAN_FALLBACK_FIELDS)
+_OWNER_FALLBACK_DEFAULTS = {"id_attachment": None, "id_attachment_name": None}
+_SITEPLAN_FALLBACK_DEFAULTS = {"application_file": None}
+
+
+def _log_representation_error(serializer, serializer_name, label, instance, exc):
+    """
+    ✅ traceback كامل لأول خطأ فقط لكل serializer (نفس الـ child يخدم كل الصفوف في many=True)
+    الصفوف التالية بنفس الطلب: سطر تحذير بدون تنسيق traceback
+    """
+    if serializer.__dict__.get('_representation_error_logged'):
+        logger.warning("Error in %s.to_representation for %s %s: %s", serializer_name, label, instance.pk, exc)
+        return
+    serializer.__dict__['_representation_error_logged'] = True
+    logger.exception("Error in %s.to_representation for %s %s", serializer_name, label, instance.pk)
+
+
+def _iso_or_none(value):
+    return value.isoformat() if value else None
+
+
+def _owner_fallback_representation(instance):
+    data = dict(zip(_OWNER_FALLBACK_FIELDS, _owner_fallback_values(instance))) | _OWNER_FALLBACK_DEFAULTS
+    data["id_issue_date"] = _iso_or_none(instance.id_issue_date)
+    data["id_expiry_date"] = _iso_or_none(instance.id_expiry_date)
+    data["share_percent"] = str(instance.share_percent)
+    return data
+
+
+def _siteplan_fallback_representation(instance):
+    data = dict(zip(_SITEPLAN_FALLBACK_FIELDS, _siteplan_fallback_values(instance))) | _SITEPLAN_FALLBACK_DEFAULTS
+    data["owners"] = []  # ✅ قائمة فارغة بدلاً من خطأ
+    data["project"] = instance.project_id
+    data["plot_area_sqm"] = str(instance.plot_area_sqm) if instance.plot_area_sqm is not None else ''
+    data["plot_area_sqft"] = str(instance.plot_area_sqft) if instance.plot_area_sqft is not None else ''
+    data["application_date"] = _iso_or_none(instance.application_date)
+    data["created_at"] = _iso_or_none(instance.created_at)
+    data["updated_at"] = _iso_or_none(instance.updated_at)
+    return data
+
+
 class SitePlanOwnerSerializer(serializers.ModelSerializer):
     id_attachment = serializers.FileField(required=False, allow_null=True)
 
@@ -649,16 +746,13 @@ class SitePlanOwnerSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """معالجة آمنة للبيانات مع التعامل مع الحقول المفقودة"""
         try:
-            data = super().to_representation(instance)
-            
-            # ✅ التأكد من وجود الحقول الجديدة مع قيم افتراضية
-            if "age" not in data:
-                data["age"] = instance.age if hasattr(instance, 'age') else None
-            if "is_authorized" not in data:
-                data["is_authorized"] = instance.is_authorized if hasattr(instance, 'is_authorized') else False
+            data = {}
+            for name, attr, to_repr in self._bound_fields():
+                value = getattr(instance, attr)
+                data[name] = None if value is None or to_repr is None else to_repr(value)
             
-            # ✅ استخدام الدالة الموحدة لـ id_attachment
-            id_attachment = getattr(instance, 'id_attachment', None)
+            # ✅ استخدام الدالة الموحدة لـ id_attachment (حقل معرّف في الموديل - لا حاجة لـ getattr)
+            id_attachment = instance.id_attachment
             if id_attachment:
                 data["id_attachment"] = get_file_url(id_attachment)
                 # ✅ إضافة اسم الملف الموحد
@@ -669,27 +763,42 @@ class SitePlanOwnerSerializer(serializers.ModelSerializer):
             
             return data
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error in SitePlanOwnerSerializer.to_representation for owner {instance.id}: {e}", exc_info=True)
+            _log_representation_error(self, "SitePlanOwnerSerializer", "owner", instance, e)
             # ✅ إرجاع بيانات أساسية في حالة الخطأ
-            return {
-                "id": instance.id if hasattr(instance, 'id') else None,
-                "owner_name_ar": getattr(instance, 'owner_name_ar', ''),
-                "owner_name_en": getattr(instance, 'owner_name_en', ''),
-                "nationality": getattr(instance, 'nationality', ''),
-                "phone": getattr(instance, 'phone', ''),
-                "email": getattr(instance, 'email', ''),
-                "id_number": getattr(instance, 'id_number', ''),
-                "id_issue_date": instance.id_issue_date.isoformat() if hasattr(instance, 'id_issue_date') and instance.id_issue_date else None,
-                "id_expiry_date": instance.id_expiry_date.isoformat() if hasattr(instance, 'id_expiry_date') and instance.id_expiry_date else None,
-                "id_attachment": None,
-                "right_hold_type": getattr(instance, 'right_hold_type', 'Ownership'),
-                "share_possession": getattr(instance, 'share_possession', ''),
-                "share_percent": str(getattr(instance, 'share_percent', '100')),
-                "age": getattr(instance, 'age', None) if hasattr(instance, 'age') else None,
-                "is_authorized": getattr(instance, 'is_authorized', False) if hasattr(instance, 'is_authorized') else False,
-            }
+            return _owner_fallback_representation(instance)
+
+    def _bound_fields(self):
+        """
+        ✅ (اسم الحقل، attribute الموديل، to_representation) مخزنة مرة واحدة لكل serializer
+        نفس الـ child يخدم كل الملاك في many=True - بدون field.get_attribute لكل حقل لكل مالك
+        كل الحقول هنا حقول موديل مباشرة (source من مستوى واحد)
+        id_attachment يُحسب بعد الحلقة عبر get_file_url (to_repr = None)
+        """
+        bound = self.__dict__.get('_bound_fields_cache')
+        if bound is None:
+            bound = self.__dict__['_bound_fields_cache'] = [
+                (f.field_name, f.source_attrs[0], None if f.field_name == 'id_attachment' else f.to_representation)
+                for f in self._readable_fields
+            ]
+        return bound
+
+
+class _LicenseSync:
+    """
+    callback on_commit لمزامنة ملاك SitePlan إلى الرخصة/العقد (انظر SitePlanSerializer._schedule_license_sync)
+    ✅ يقرأ SitePlan والملاك من قاعدة البيانات بعد الـ commit - لا يعتمد على حالة في الذاكرة
+    """
+
+    def __init__(self, serializer, siteplan_id):
+        self.serializer = serializer
+        self.siteplan_id = siteplan_id
+
+    def __call__(self):
+        siteplan = SitePlan.objects.select_related("project").filter(pk=self.siteplan_id).first()
+        if siteplan is None:
+            return
+        with transaction.atomic():
+            self.serializer._sync_owners_to_license_and_contract(siteplan)
 
 
 class SitePlanSerializer(serializers.ModelSerializer):
@@ -721,8 +830,15 @@ class SitePlanSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["project", "created_at", "updated_at"]
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """✅ تحميل الملاك دفعة واحدة لكل الـ queryset (بدل استعلام owners لكل SitePlan)"""
+        return queryset.select_related("project").prefetch_related(
+            models.Prefetch("owners", queryset=SitePlanOwner.objects.order_by("id"))
+        )
+
     # ----- helpers -----
-    _owner_allowed = {
+    _owner_allowed = frozenset({
         "id",  # ✅ إضافة id للملاك الموجودين
         "owner_name_ar", "owner_name_en",
         "nationality", "phone", "email",
@@ -730,8 +846,10 @@ class SitePlanSerializer(serializers.ModelSerializer):
         "right_hold_type", "share_possession", "share_percent",
         "age",  # ✅ العمر المحسوب تلقائياً
         "is_authorized",  # ✅ المالك المفوض
-    }
+    })
+    _true_strings = _TRUE_STRINGS
     _owners_key_re = re.compile(r"^owners\[(\d+)\]\[(\w+)\]$")
+    _owners_key_prefix = "owners["  # ✅ فلتر سريع (startswith) قبل الـ regex
 
     @staticmethod
     def _normalize_owner(o: dict):
@@ -745,28 +863,17 @@ class SitePlanSerializer(serializers.ModelSerializer):
         if en and not ar:
             ar = en
 
+        # ✅ مرور واحد على الحقول المسموحة (يشمل id وكل الحقول المهمة)
         c = {k: o.get(k) for k in SitePlanSerializer._owner_allowed if k in o}
         
         # ✅ تحويل is_authorized إلى boolean
         if "is_authorized" in c:
-            is_auth = c["is_authorized"]
-            if isinstance(is_auth, str):
-                c["is_authorized"] = is_auth.lower() in ("true", "1", "yes")
-            elif not isinstance(is_auth, bool):
-                c["is_authorized"] = bool(is_auth)
-        
-        # ✅ الحفاظ على id إذا كان موجوداً (للملاك الموجودين)
-        if "id" in o:
-            c["id"] = o["id"]
+            c["is_authorized"] = _parse_bool(c["is_authorized"])
+        
         if ar:
             c["owner_name_ar"] = ar
         if en:
             c["owner_name_en"] = en
-        # ✅ التأكد من أن جميع الحقول المهمة موجودة
-        for field in ["id_number", "nationality", "phone", "email", "id_issue_date", "id_expiry_date", 
-                      "right_hold_type", "share_possession", "share_percent"]:
-            if field in o:
-                c[field] = o[field]
         if "share_percent" in c and c["share_percent"] in ("", None):
             c["share_percent"] = None
         return c
@@ -780,8 +887,8 @@ class SitePlanSerializer(serializers.ModelSerializer):
         try:
             data = super().to_representation(instance)
             
-            # ✅ استخدام الدالة الموحدة لـ application_file
-            application_file = getattr(instance, 'application_file', None)
+            # ✅ استخدام الدالة الموحدة لـ application_file (حقل معرّف في الموديل - لا حاجة لـ getattr)
+            application_file = instance.application_file
             if application_file:
                 data["application_file"] = get_file_url(application_file)
                 # ✅ إضافة اسم الملف الموحد
@@ -797,31 +904,12 @@ class SitePlanSerializer(serializers.ModelSerializer):
             
             return data
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error in SitePlanSerializer.to_representation for SitePlan {instance.id}: {e}", exc_info=True)
+            _log_representation_error(self, "SitePlanSerializer", "SitePlan", instance, e)
             # ✅ إرجاع بيانات أساسية في حالة الخطأ
             try:
-                return {
-                    "id": instance.id if hasattr(instance, 'id') else None,
-                    "project": instance.project_id if hasattr(instance, 'project_id') else None,
-                    "municipality": getattr(instance, 'municipality', ''),
-                    "zone": getattr(instance, 'zone', ''),
-                    "sector": getattr(instance, 'sector', ''),
-                    "plot_area_sqm": str(getattr(instance, 'plot_area_sqm', '')) if hasattr(instance, 'plot_area_sqm') else '',
-                    "plot_area_sqft": str(getattr(instance, 'plot_area_sqft', '')) if hasattr(instance, 'plot_area_sqft') else '',
-                    "land_no": getattr(instance, 'land_no', ''),
-                    "allocation_type": getattr(instance, 'allocation_type', ''),
-                    "land_use": getattr(instance, 'land_use', ''),
-                    "application_number": getattr(instance, 'application_number', ''),
-                    "application_date": instance.application_date.isoformat() if hasattr(instance, 'application_date') and instance.application_date else None,
-                    "application_file": None,
-                    "owners": [],  # ✅ قائمة فارغة بدلاً من خطأ
-                    "created_at": instance.created_at.isoformat() if hasattr(instance, 'created_at') and instance.created_at else None,
-                    "updated_at": instance.updated_at.isoformat() if hasattr(instance, 'updated_at') and instance.updated_at else None,
-                }
-            except Exception as inner_e:
-                logger.error(f"Error creating fallback representation: {inner_e}", exc_info=True)
+                return _siteplan_fallback_representation(instance)
+            except Exception:
+                logger.exception("Error creating fallback representation")
                 # ✅ إرجاع بيانات فارغة كملاذ أخير
                 return {
                     "id": None,
@@ -837,30 +925,48 @@ class SitePlanSerializer(serializers.ModelSerializer):
             return None
 
         data = req.data
-        import logging
-        logger = logging.getLogger(__name__)
         
-        # ✅ Debug: طباعة نوع البيانات
-        logger.info(f"Extract owners: req.data type: {type(data)}, has items: {hasattr(data, 'items')}")
-        if hasattr(data, 'keys'):
+        # ✅ Debug: طباعة نوع البيانات (مسح المفاتيح بالكامل فقط عند تفعيل DEBUG)
+        if logger.isEnabledFor(logging.DEBUG) and hasattr(data, 'keys'):
             all_keys = list(data.keys())
-            logger.info(f"Extract owners: req.data total keys: {len(all_keys)}")
-            # ✅ البحث عن مفاتيح owners
-            owner_keys = [k for k in all_keys if 'owner' in k.lower()]
-            logger.info(f"Extract owners: owner-related keys: {owner_keys}")
-            # ✅ طباعة جميع المفاتيح التي تطابق pattern owners[...]
             matching_keys = [k for k in all_keys if self._owners_key_re.match(str(k))]
-            logger.info(f"Extract owners: matching owners pattern keys: {matching_keys}")
+            logger.debug(f"Extract owners: req.data type: {type(data)}, total keys: {len(all_keys)}, matching owners pattern keys: {matching_keys}")
             if not matching_keys:
-                logger.warning(f"Extract owners: NO keys matching owners pattern!")
-                # ✅ طباعة جميع المفاتيح للتحقق
-                logger.warning(f"Extract owners: All req.data keys: {all_keys}")
-                # ✅ البحث عن أي مفاتيح تحتوي على "owner" (حتى لو لم تطابق الـ pattern)
-                any_owner_keys = [k for k in all_keys if 'owner' in str(k).lower()]
-                if any_owner_keys:
-                    logger.warning(f"Extract owners: Found keys with 'owner' in name: {any_owner_keys}")
-        
-        # الحصول على الملفات من request.FILES
+                logger.debug(f"Extract owners: NO keys matching owners pattern! All req.data keys: {all_keys}")
+        
+        # معالجة البيانات النصية
+        # ✅ التحقق من وجود "owners" كـ list أو string أولاً
+        owners_raw = data.get("owners")
+        logger.debug("Extract owners: owners_raw type: %s, value: %r", type(owners_raw), owners_raw)
+        
+        raw = None  # تهيئة raw
+        
+        if isinstance(owners_raw, list) and len(owners_raw) > 0:
+            raw = owners_raw
+            logger.debug("Extract owners: Found owners as list, count: %d", len(raw))
+        elif isinstance(owners_raw, str) and owners_raw.strip():
+            # ✅ التحقق من أن الـ string ليس "[object Object]" (خطأ في JavaScript)
+            if owners_raw.strip() in ("[object Object]", "[object object]"):
+                logger.warning("Extract owners: owners is '[object Object]' string (JS error), ignoring and extracting from keys")
+                raw = None  # تجاهل هذا القيمة الخاطئة
+            else:
+                try:
+                    parsed = _json_loads(owners_raw)
+                    raw = parsed if isinstance(parsed, list) and len(parsed) > 0 else None
+                    if raw:
+                        logger.debug("Extract owners: Found owners as JSON string, parsed count: %d", len(raw))
+                    else:
+                        logger.debug("Extract owners: Parsed owners is empty, trying to extract from keys")
+                except Exception as e:
+                    logger.warning("Extract owners: Failed to parse owners JSON string: %s, trying to extract from keys", e)
+                    raw = None  # تجاهل هذا القيمة الخاطئة
+        
+        # ✅ owners وصل كـ list/JSON صالح - لا حاجة لمسح مفاتيح POST/req.data أو قراءة الملفات
+        if raw is not None:
+            return self._clean_owners(raw)
+
+        # ✅ إذا لم يكن owners موجوداً كـ list أو string صالح، نحاول استخراجه من المفاتيح
+        # الحصول على الملفات من request.FILES (مطلوبة فقط لمسار المفاتيح)
         try:
             files = req.FILES
         except AttributeError:
@@ -876,169 +982,94 @@ class SitePlanSerializer(serializers.ModelSerializer):
             # ✅ محاولة من req._request.POST (الطلب الأصلي في DRF)
             if hasattr(req, '_request') and hasattr(req._request, 'POST'):
                 post_data = req._request.POST
-                logger.info(f"Extract owners: req._request.POST available, type: {type(post_data)}")
-                if post_data and hasattr(post_data, 'keys'):
-                    logger.info(f"Extract owners: req._request.POST keys (first 20): {list(post_data.keys())[:20]}")
             # ✅ محاولة من req.POST (fallback)
             elif hasattr(req, 'POST'):
                 post_data = req.POST
-                logger.info(f"Extract owners: req.POST available, type: {type(post_data)}")
-                if post_data and hasattr(post_data, 'keys'):
-                    logger.info(f"Extract owners: req.POST keys (first 20): {list(post_data.keys())[:20]}")
         except Exception as e:
             logger.warning(f"Extract owners: req.POST not available: {e}")
             pass
 
-        # معالجة البيانات النصية
-        # ✅ التحقق من وجود "owners" كـ list أو string أولاً
-        owners_raw = data.get("owners")
-        logger.info(f"Extract owners: owners_raw type: {type(owners_raw)}, value: {owners_raw}")
+        buckets = defaultdict(dict)
         
-        raw = None  # تهيئة raw
+        # ✅ أولاً: محاولة استخراج من req._request.POST مباشرة (البيانات النصية من FormData)
+        # ✅ في DRF مع MultiPartParser، req._request.POST يحتوي على البيانات النصية من FormData
+        # ✅ هذا مهم جداً - عندما يكون هناك ملفات، req.data قد لا يحتوي على البيانات النصية
+        if post_data and hasattr(post_data, 'items'):
+            try:
+                self._collect_owner_fields(post_data.items(), buckets)
+            except Exception:
+                logger.exception("Error extracting from req._request.POST")
         
-        if isinstance(owners_raw, list) and len(owners_raw) > 0:
-            raw = owners_raw
-            logger.info(f"Extract owners: Found owners as list, count: {len(raw)}")
-        elif isinstance(owners_raw, str) and owners_raw.strip():
-            # ✅ التحقق من أن الـ string ليس "[object Object]" (خطأ في JavaScript)
-            if owners_raw.strip() in ("[object Object]", "[object object]"):
-                logger.warning(f"Extract owners: owners is '[object Object]' string (JS error), ignoring and extracting from keys")
-                raw = None  # تجاهل هذا القيمة الخاطئة
-            else:
-                try:
-                    parsed = json.loads(owners_raw)
-                    raw = parsed if isinstance(parsed, list) and len(parsed) > 0 else None
-                    if raw:
-                        logger.info(f"Extract owners: Found owners as JSON string, parsed count: {len(raw)}")
-                    else:
-                        logger.warning(f"Extract owners: Parsed owners is empty, trying to extract from keys")
-                except Exception as e:
-                    logger.warning(f"Extract owners: Failed to parse owners JSON string: {e}, trying to extract from keys")
-                    raw = None  # تجاهل هذا القيمة الخاطئة
+        # ✅ ثانياً: محاولة استخراج من req.data (fallback إذا لم يكن post_data متاحاً)
+        if not buckets and hasattr(data, 'items'):
+            try:
+                # ✅ تخطي الملفات - سنتعامل معها من req.FILES
+                self._collect_owner_fields(data.items(), buckets, skip_files=True)
+            except Exception:
+                logger.exception("Error extracting from req.data")
         
-        # ✅ إذا لم يكن owners موجوداً كـ list أو string صالح، نحاول استخراجه من المفاتيح
-        if raw is None:
-            buckets = {}
-            logger.info(f"Extract owners: owners not found as valid list/string, trying to extract from keys (owners[0][...])")
-            
-            # ✅ أولاً: محاولة استخراج من req._request.POST مباشرة (البيانات النصية من FormData)
-            # ✅ في DRF مع MultiPartParser، req._request.POST يحتوي على البيانات النصية من FormData
-            # ✅ هذا مهم جداً - عندما يكون هناك ملفات، req.data قد لا يحتوي على البيانات النصية
-            if post_data and hasattr(post_data, 'get'):
-                try:
-                    post_keys = list(post_data.keys()) if hasattr(post_data, 'keys') else []
-                    logger.info(f"Extract owners: Iterating over req._request.POST, total keys: {len(post_keys)}")
-                    
-                    for k in post_keys:
-                        v = post_data.get(k)
-                        
-                        # ✅ التحقق من الـ pattern
-                        k_str = str(k)
-                        m = self._owners_key_re.match(k_str)
-                        if not m:
-                            continue
-                        
-                        idx = int(m.group(1))
-                        key = m.group(2)
-                        # ✅ تجاهل id_attachment_url لأنه ليس حقل في النموذج
-                        if key == "id_attachment_url":
-                            continue
-                        
-                        logger.info(f"Extract owners: Found owner field in req._request.POST: owners[{idx}][{key}] = {v}")
-                        # ✅ معالجة id_attachment_delete كـ boolean
-                        if key == "id_attachment_delete":
-                            buckets.setdefault(idx, {})[key] = str(v).lower() in ("true", "1", "yes")
-                        else:
-                            buckets.setdefault(idx, {})[key] = v
-                    
-                    logger.info(f"Extract owners: After req._request.POST extraction, buckets count: {len(buckets)}")
-                except Exception as e:
-                    logger.error(f"Error extracting from req._request.POST: {e}", exc_info=True)
-            
-            # ✅ ثانياً: محاولة استخراج من req.data (fallback إذا لم يكن post_data متاحاً)
-            if not buckets and hasattr(data, 'get'):
-                try:
-                    # ✅ QueryDict في Django - نستخدم .keys() للحصول على جميع المفاتيح
-                    data_keys = list(data.keys()) if hasattr(data, 'keys') else []
-                    logger.info(f"Extract owners: Fallback - Iterating over req.data, total keys: {len(data_keys)}")
-                    
-                    for k in data_keys:
-                        # ✅ تخطي الملفات - سنتعامل معها من req.FILES
-                        v = data.get(k)
-                        if hasattr(v, 'read'):  # File object
-                            continue
-                        
-                        # ✅ التحقق من الـ pattern
-                        k_str = str(k)
-                        m = self._owners_key_re.match(k_str)
-                        if not m:
-                            continue
-                        
-                        idx = int(m.group(1))
-                        key = m.group(2)
-                        # ✅ تجاهل id_attachment_url لأنه ليس حقل في النموذج
-                        if key == "id_attachment_url":
-                            continue
-                        
-                        logger.info(f"Extract owners: Found owner field in req.data: owners[{idx}][{key}] = {v}")
-                        # ✅ معالجة id_attachment_delete كـ boolean
-                        if key == "id_attachment_delete":
-                            buckets.setdefault(idx, {})[key] = str(v).lower() in ("true", "1", "yes")
-                        else:
-                            buckets.setdefault(idx, {})[key] = v
-                    
-                    logger.info(f"Extract owners: After req.data extraction, buckets count: {len(buckets)}")
-                except Exception as e:
-                    logger.error(f"Error extracting from req.data: {e}", exc_info=True)
-            
-            
-            # ✅ دمج الملفات من req.FILES
-            if files:
-                try:
-                    logger.info(f"Extract owners: Processing files from req.FILES, count: {len(files) if hasattr(files, '__len__') else 'unknown'}")
-                    for k, v in files.items():
-                        k_str = str(k)
-                        m = self._owners_key_re.match(k_str)
-                        if not m:
-                            continue
-                        idx = int(m.group(1))
-                        key = m.group(2)
-                        if key == "id_attachment":  # فقط ملفات الهوية
-                            logger.info(f"Extract owners: Found id_attachment file for owner {idx}: {k_str}")
-                            buckets.setdefault(idx, {})[key] = v
-                except (AttributeError, TypeError) as e:
-                    logger.error(f"Extract owners: Error processing files: {e}", exc_info=True)
-            
-            # ✅ إذا كان هناك buckets، نرجع قائمة الملاك
-            # إذا لم يكن هناك buckets، نرجع None (يعني لم يتم إرسال owners)
-            raw = [buckets[i] for i in sorted(buckets.keys())] if buckets else None
-            logger.info(f"Extract owners: buckets count: {len(buckets) if buckets else 0}, raw: {len(raw) if raw else 0}")
-            if buckets:
-                logger.info(f"Extract owners: buckets content: {buckets}")
-
-        if raw is None:
-            logger.warning("Extract owners: raw is None, returning None")
+        # ✅ دمج الملفات من req.FILES (فقط ملفات الهوية)
+        if files:
+            try:
+                match = self._owners_key_re.match
+                prefix = self._owners_key_prefix
+                for k, v in files.items():
+                    if not k.startswith(prefix):
+                        continue
+                    m = match(k)
+                    if m is not None and m.group(2) == "id_attachment":
+                        buckets[int(m.group(1))]["id_attachment"] = v
+            except (AttributeError, TypeError):
+                logger.exception("Extract owners: Error processing files")
+        
+        # ✅ إذا كان هناك buckets، نرجع قائمة الملاك
+        # إذا لم يكن هناك buckets، نرجع None (يعني لم يتم إرسال owners)
+        logger.debug("Extract owners: buckets count: %d, content: %s", len(buckets), buckets)
+        if not buckets:
+            logger.debug("Extract owners: no owners keys, returning None")
             return None
+        return self._clean_owners([buckets[i] for i in sorted(buckets)])
 
-        # تنظيف وتطبيع البيانات
+    def _clean_owners(self, raw):
+        """تنظيف وتطبيع قائمة الملاك (تخطي غير الـ dict ومن بدون اسم)"""
         cleaned = []
         for idx, o in enumerate(raw):
             if not isinstance(o, dict):
-                logger.warning(f"Extract owners: Skipping non-dict at index {idx}: {type(o)}")
+                logger.warning("Extract owners: Skipping non-dict at index %s: %s", idx, type(o))
                 continue
             c = self._normalize_owner(o)
             has_name = self._has_name(c)
             if has_name:
                 cleaned.append(c)
-                logger.info(f"Extract owners: Added owner {idx} to cleaned list")
             else:
-                logger.warning(f"Extract owners: Skipping owner {idx} without name. Normalized: {c}")
+                logger.debug("Extract owners: Skipping owner %s without name. Normalized: %s", idx, c)
         
-        logger.info(f"Extract owners: Final cleaned count: {len(cleaned)}")
-        if cleaned:
-            logger.info(f"Extract owners: Cleaned owners: {cleaned}")
+        logger.debug("Extract owners: Final cleaned count: %d", len(cleaned))
         return cleaned
 
+    def _collect_owner_fields(self, items, buckets, skip_files=False):
+        """مرور واحد على أزواج (key, value) وتجميع حقول owners[i][field] في buckets (defaultdict(dict))"""
+        match = self._owners_key_re.match
+        prefix = self._owners_key_prefix
+        true_strings = self._true_strings
+        for k, v in items:
+            # ✅ معظم مفاتيح الطلب ليست owners[...] - startswith أرخص بكثير من الـ regex
+            if not k.startswith(prefix):
+                continue
+            if skip_files and hasattr(v, 'read'):  # File object
+                continue
+            m = match(k)
+            if m is None:
+                continue
+            key = m.group(2)
+            # ✅ تجاهل id_attachment_url لأنه ليس حقل في النموذج
+            if key == "id_attachment_url":
+                continue
+            # ✅ معالجة id_attachment_delete كـ boolean
+            if key == "id_attachment_delete":
+                v = str(v).lower() in true_strings
+            buckets[int(m.group(1))][key] = v
+
     def validate(self, attrs):
         owners_in_attrs = attrs.get("owners", None)
         if isinstance(owners_in_attrs, list):
@@ -1050,69 +1081,60 @@ class SitePlanSerializer(serializers.ModelSerializer):
             attrs["owners"] = normalized
         return attrs
 
-    def _update_project_name_from_owners(self, siteplan: SitePlan):
-        """تحديث اسم المشروع بناءً على المالك المفوض"""
-        # ✅ إعادة تحميل الملاك من قاعدة البيانات للتأكد من أحدث البيانات
-        siteplan.refresh_from_db()
-        qs = siteplan.owners.all()
-        owners_count = qs.count()
-        
-        # ✅ البحث عن المالك المفوض أولاً
-        authorized_owner = qs.filter(is_authorized=True).first()
-        
-        if authorized_owner:
-            ar = (authorized_owner.owner_name_ar or "").strip()
-            en = (authorized_owner.owner_name_en or "").strip()
-            main = ar or en
+    def _update_project_name_from_owners(self, siteplan: SitePlan, owners=None):
+        """
+        تحديث اسم المشروع بناءً على المالك المفوض (Project.name هو اسم العرض المخزن)
+        owners: قائمة الملاك المحفوظة للتو (بترتيب الإنشاء) - تُحسب منها مباشرة بدون استعلام
+        """
+        if owners is not None:
+            # ✅ بدون أي استعلام: count/المفوض/أول اسم من القائمة نفسها
+            # ✅ المفوض أولاً ثم ترتيب الإنشاء (نفس SitePlanOwner.DISPLAY_NAME_ORDERING)
+            rows = [(o.is_authorized, o.owner_name_ar, o.owner_name_en) for o in sorted(owners, key=lambda o: not o.is_authorized)]
+            new_name = SitePlanOwner.display_name_from_rows(rows)
         else:
-            # ✅ إذا لم يكن هناك مالك مفوض محدد، نستخدم الأول (للتوافق مع البيانات القديمة)
-            main = ""
-            for o in qs.order_by("id"):
-                ar = (o.owner_name_ar or "").strip()
-                en = (o.owner_name_en or "").strip()
-                if ar or en:
-                    main = ar or en
-                    break
-        
-        if main:
-            new_name = f"{main} وشركاؤه" if owners_count > 1 else main
-            # ✅ تحديث اسم المشروع فقط إذا كان مختلفاً
-            if siteplan.project.name != new_name:
-                siteplan.project.name = new_name
-                siteplan.project.save(update_fields=["name"])
+            # ✅ display_name_for يقرأ الملاك من قاعدة البيانات مباشرة (بدون refresh_from_db)
+            new_name = SitePlanOwner.display_name_for(siteplan.pk)
+        # ✅ تحديث اسم المشروع فقط إذا كان مختلفاً
+        if new_name and siteplan.project.name != new_name:
+            siteplan.project.name = new_name
+            siteplan.project.save(update_fields=["name"])
+
+    def _schedule_license_sync(self, siteplan: SitePlan):
+        """
+        ✅ مزامنة الرخصة/العقد بعد نجاح الـ transaction - مرة واحدة لكل SitePlan
+        الـ callback يقرأ الملاك من قاعدة البيانات، فحفظ نفس الـ SitePlan أكثر من مرة
+        (أو التراجع عن savepoint) لا يغيّر ما يُكتب
+        """
+        on_commit_once(("license_sync", siteplan.pk), _LicenseSync(self, siteplan.pk))
 
     def _sync_owners_to_license_and_contract(self, siteplan: SitePlan):
-        """تحديث الملاك في الرخصة والعقد تلقائياً عند تحديثها في Site Plan"""
+        """
+        تحديث الملاك في الرخصة والعقد تلقائياً عند تحديثها في Site Plan
+        ✅ الملاك من قاعدة البيانات (values()) - قيم مطبّعة بنفس شكل المخزن في الرخصة
+        """
         try:
             project = siteplan.project
             
             # ✅ تحديث الرخصة
             try:
                 license_obj = project.license
-                # ✅ تحديث siteplan_snapshot
-                license_obj.siteplan_snapshot = build_siteplan_snapshot(siteplan)
+                update_fields = []
+                # ✅ تحديث siteplan_snapshot (فقط إذا تغيّر عن المخزن - مثلاً تعديل لا يمس حقول اللقطة)
+                siteplan_snapshot = _as_stored_json(build_siteplan_snapshot(siteplan, self.context))
+                if license_obj.siteplan_snapshot != siteplan_snapshot:
+                    license_obj.siteplan_snapshot = siteplan_snapshot
+                    update_fields.append("siteplan_snapshot")
                 
                 # ✅ تحديث حقل owners في الرخصة من الملاك الجديدة
-                owners_list = []
-                for o in siteplan.owners.all().order_by("id"):
-                    owners_list.append({
-                        "owner_name_ar": o.owner_name_ar,
-                        "owner_name_en": o.owner_name_en,
-                        "nationality": o.nationality,
-                        "phone": o.phone,
-                        "email": o.email,
-                        "id_number": o.id_number,
-                        "id_issue_date": o.id_issue_date.isoformat() if o.id_issue_date else "",
-                        "id_expiry_date": o.id_expiry_date.isoformat() if o.id_expiry_date else "",
-                        "right_hold_type": o.right_hold_type,
-                        "share_possession": o.share_possession,
-                        "share_percent": str(o.share_percent) if o.share_percent is not None else "100.00",
-                        "age": o.age,  # ✅ العمر المحسوب تلقائياً
-                        "is_authorized": o.is_authorized,  # ✅ المالك المفوض
-                    })
+                # ✅ values() - dicts مباشرة بدون إنشاء كائنات SitePlanOwner
+                rows = siteplan.owners.order_by("id").values(*_LICENSE_OWNER_FIELDS)
+                owners_list = [_license_owner_row(row) for row in rows]
                 
-                license_obj.owners = owners_list
-                license_obj.save(update_fields=["siteplan_snapshot", "owners"])
+                if license_obj.owners != owners_list:
+                    license_obj.owners = owners_list
+                    update_fields.append("owners")
+                if update_fields:
+                    license_obj.save(update_fields=update_fields)
             except BuildingLicense.DoesNotExist:
                 pass
             
@@ -1121,11 +1143,12 @@ class SitePlanSerializer(serializers.ModelSerializer):
                 contract_obj = project.contract
                 # ✅ إذا كانت الرخصة موجودة، نحدث license_snapshot في العقد
                 try:
+                    # ✅ نفس كائن الرخصة المحفوظ أعلاه (project.license مخزن) - بدون refresh_from_db
                     license_obj = project.license
-                    # ✅ إعادة تحميل الرخصة للتأكد من أحدث البيانات (بما فيها owners المحدثة)
-                    license_obj.refresh_from_db()
-                    contract_obj.license_snapshot = build_license_snapshot(license_obj)
-                    contract_obj.save(update_fields=["license_snapshot"])
+                    license_snapshot = _as_stored_json(build_license_snapshot(license_obj))
+                    if contract_obj.license_snapshot != license_snapshot:
+                        contract_obj.license_snapshot = license_snapshot
+                        contract_obj.save(update_fields=["license_snapshot"])
                 except BuildingLicense.DoesNotExist:
                     pass
             except Contract.DoesNotExist:
@@ -1133,11 +1156,14 @@ class SitePlanSerializer(serializers.ModelSerializer):
                 
         except Exception as e:
             # ✅ في حالة الخطأ، نكمل العملية (لا نوقف تحديث Site Plan)
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error syncing owners to license and contract: {e}")
 
     def create(self, validated_data):
+        # ✅ SitePlan + الملاك + اسم المشروع + مزامنة الرخصة/العقد في transaction واحدة
+        with transaction.atomic():
+            return self._create(validated_data)
+
+    def _create(self, validated_data):
         owners_data = validated_data.pop("owners", None)
         if owners_data is None:
             owners_data = self._extract_owners_from_request() or []
@@ -1165,63 +1191,70 @@ class SitePlanSerializer(serializers.ModelSerializer):
                 # ✅ تحديث siteplan.application_file بالمسار المحفوظ
                 siteplan.application_file = saved_path
                 siteplan.save(update_fields=['application_file'])
-            except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"Error saving application_file in create: {e}", exc_info=True)
+            except Exception:
+                logger.exception("Error saving application_file in create")
                 # Fallback: استخدام الطريقة العادية
                 siteplan.application_file = file_obj
                 siteplan.save(update_fields=['application_file'])
         
-        # ✅ حفظ الملاك بشكل صحيح
-        for idx, od in enumerate(owners_data):
-            # ✅ استخراج id_attachment من od
-            file_obj = od.pop("id_attachment", None)
-            owner = SitePlanOwner.objects.create(siteplan=siteplan, **od)
-            
+        # ✅ حفظ الملاك: INSERT واحد لكل الملاك (بترتيبهم) ثم حفظ ملفات الهوية فقط لمن لديه ملف
+        # bulk_create لا يستدعي save() - نحسب العمر هنا
+        files = []
+        owners = []
+        for od in owners_data:
+            files.append(od.pop("id_attachment", None))
+            owner = SitePlanOwner(siteplan=siteplan, **od)
+            owner.age = owner.calculate_age_from_id()
+            owners.append(owner)
+        SitePlanOwner.objects.bulk_create(owners)
+
+        for idx, (owner, file_obj) in enumerate(zip(owners, files)):
             # ✅ إضافة الملف إذا كان موجوداً مع تعيين الفهرس للدالة upload_to
             if file_obj:
                 owner._owner_index = idx + 1
-                # حذف أي ملف سابق بنفس المسار لتفادي إضافة لاحقة
-                if owner.id_attachment:
-                    try:
-                        owner.id_attachment.delete(save=False)
-                    except Exception:
-                        pass
                 owner.id_attachment = file_obj
-                owner.save()
+                owner.save(update_fields=["id_attachment"])
 
-        # ✅ تحديث اسم المشروع بعد إنشاء الملاك
-        siteplan.refresh_from_db()
-        self._update_project_name_from_owners(siteplan)
+        # ✅ bulk_create لا يرسل post_save - إنشاء هيكل المجلدات (كان يتم عبر signal إضافة مالك)
+        if owners:
+            from .signals import create_folder_structure_after_commit
+            create_folder_structure_after_commit(siteplan.project_id, "after adding owners", only_if_missing=True)
+
+        # ✅ تحديث اسم المشروع من الملاك المحفوظة (بدون refresh_from_db/استعلامات)
+        self._update_project_name_from_owners(siteplan, owners)
         
         # ✅ تحديث الملاك في الرخصة والعقد تلقائياً (إذا كانت موجودة)
-        self._sync_owners_to_license_and_contract(siteplan)
+        self._schedule_license_sync(siteplan)
         
         return siteplan
 
-
     def update(self, instance, validated_data):
+        # ✅ SitePlan + الملاك (bulk) + اسم المشروع + مزامنة الرخصة/العقد في transaction واحدة
+        with transaction.atomic():
+            # ✅ قفل صف الـ SitePlan: طلبات PUT/PATCH المتزامنة على نفس المخطط تُنفَّذ بالتتابع
+            # (بدون إعادة تحميل instance - نحافظ على الملاك المحمّلة مسبقاً من الـ view)
+            list(SitePlan.objects.select_for_update().filter(pk=instance.pk).values_list("pk", flat=True))
+            return self._update(instance, validated_data)
+
+    def _update(self, instance, validated_data):
         from django.core.files.uploadedfile import InMemoryUploadedFile, UploadedFile
-        import logging
-        logger = logging.getLogger(__name__)
 
         # -----------------------------
         # 1) سحب الملاك من validated_data (يمنع owners = ...)
         # -----------------------------
         owners_data = validated_data.pop("owners", None)
-        logger.info(f"Update: owners_data from validated_data: {owners_data is not None}")
+        logger.debug("Update: owners_data from validated_data: %s", owners_data is not None)
         
         # ✅ دائماً نحاول استخراج الملاك من الطلب (لأن FormData لا يمر عبر validated_data)
         extracted_owners = self._extract_owners_from_request()
-        logger.info(f"Update: extracted_owners from request: {extracted_owners is not None}, count: {len(extracted_owners) if extracted_owners else 0}")
+        logger.debug("Update: extracted_owners from request: %s", extracted_owners is not None)
         
         # ✅ نستخدم الملاك المستخرجة من الطلب إذا كانت موجودة
         if extracted_owners is not None:
             owners_data = extracted_owners
-            logger.info(f"Update: Using extracted owners, count: {len(owners_data)}")
+            logger.debug("Update: Using extracted owners, count: %d", len(owners_data))
         elif owners_data is None:
-            logger.warning("Update: No owners found in request or validated_data")
+            logger.debug("Update: No owners found in request or validated_data")
 
         # -----------------------------
         # 2) التعامل مع ملف المعاملة (application_file)
@@ -1257,8 +1290,8 @@ class SitePlanSerializer(serializers.ModelSerializer):
                 )
                 # ✅ تحديث instance.application_file بالمسار المحفوظ
                 instance.application_file = saved_path
-            except Exception as e:
-                logger.error(f"Error saving application_file: {e}", exc_info=True)
+            except Exception:
+                logger.exception("Error saving application_file")
                 # Fallback: استخدام الطريقة العادية
                 instance.application_file = file_obj
 
@@ -1286,18 +1319,34 @@ class SitePlanSerializer(serializers.ModelSerializer):
         if not owners_data:
             # حذف جميع الملاك الموجودين
             instance.owners.all().delete()
-            # تحديث اسم المشروع إلى القيمة الافتراضية
-            instance.project.name = ""
-            instance.project.save(update_fields=["name"])
+            # تحديث اسم المشروع إلى القيمة الافتراضية (فقط إذا كان مختلفاً)
+            if instance.project.name:
+                instance.project.name = ""
+                instance.project.save(update_fields=["name"])
             # ✅ تحديث الملاك في الرخصة والعقد (حذف الملاك)
-            self._sync_owners_to_license_and_contract(instance)
+            self._schedule_license_sync(instance)
             return instance
 
         # -----------------------------
         # 5) استخراج الملاك الموجودين
         # -----------------------------
-        existing = {o.id: o for o in instance.owners.all()}
+        # ✅ instance.owners.all() يستخدم prefetch الـ view (SitePlanViewSet.get_queryset) إن وُجد
+        # index_of: ترتيب المالك (1..N) للدالة upload_to - بدل list(existing).index() داخل الحلقة
+        existing = {}
+        index_of = {}
+        for position, o in enumerate(instance.owners.all(), start=1):
+            existing[o.id] = o
+            index_of[o.id] = position
         received_ids = []
+        saved_owners = []  # ✅ الملاك بعد الحفظ (لحساب اسم المشروع بدون استعلام)
+        # ✅ بدون حفظ داخل الحلقة: UPDATE واحد للملاك الموجودين و INSERT واحد للجدد
+        # (فقط الملاك الذين تغيّر ملف هويتهم يُحفظون فردياً - حفظ الملف في storage)
+        to_update = []
+        to_save_with_file = []
+        to_create = []
+        new_files = []
+        update_fields = set()
+        now = timezone.now()
 
         for od in owners_data:
             # ✅ تحويل id إلى integer إذا كان string
@@ -1317,20 +1366,21 @@ class SitePlanSerializer(serializers.ModelSerializer):
             if oid and oid in existing:
                 # ---- تحديث مالك موجود ----
                 obj = existing[oid]
+                file_changed = False
+
+                old_file_name = None
 
                 # ✅ تحديث الملف أولاً
                 if file_obj and isinstance(file_obj, (InMemoryUploadedFile, UploadedFile)):
-                    # ملف جديد - تعيين الفهرس للدالة upload_to وحذف القديم لتجنب لاحقة
-                    obj._owner_index = list(existing.keys()).index(oid) + 1
-                    if obj.id_attachment:
-                        try:
-                            obj.id_attachment.delete(save=False)
-                        except Exception:
-                            pass
+                    # ملف جديد - تعيين الفهرس للدالة upload_to (الملف القديم يُحذف عند الحفظ أدناه)
+                    obj._owner_index = index_of[oid]
+                    old_file_name = obj.id_attachment.name or None
                     obj.id_attachment = file_obj
+                    file_changed = True
                 elif delete_file:
                     # حذف الملف (إذا كان صريحاً)
                     obj.id_attachment = None
+                    file_changed = True
                 # ✅ إذا لم يكن هناك ملف جديد ولا حذف، نحافظ على الملف الموجود (لا نفعل شيء)
 
                 # ✅ تحديث باقي الحقول
@@ -1343,55 +1393,133 @@ class SitePlanSerializer(serializers.ModelSerializer):
                         continue
                     # ✅ تحديث الحقل
                     setattr(obj, k, v)
+                    update_fields.add(k)
 
-                # ✅ حفظ التغييرات
-                obj.save(update_fields=None)  # حفظ جميع الحقول
+                if file_changed:
+                    to_save_with_file.append((obj, old_file_name))
+                else:
+                    # ✅ bulk_update لا يستدعي save() - العمر و updated_at يُحدَّثان هنا
+                    obj.age = obj.calculate_age_from_id()
+                    obj.updated_at = now
+                    to_update.append(obj)
                 received_ids.append(oid)
+                saved_owners.append(obj)
 
             else:
                 # ---- مالك جديد ----
                 # ✅ إزالة id من od لأن المالك جديد
                 od.pop("id", None)
-                new_owner = SitePlanOwner.objects.create(siteplan=instance, **od)
+                new_owner = SitePlanOwner(siteplan=instance, **od)
+                new_owner.age = new_owner.calculate_age_from_id()
                 
-                # ✅ إضافة الملف إذا كان موجوداً مع تعيين الفهرس للدالة upload_to
+                # ✅ الملف يُضاف بعد الإدراج مع تعيين الفهرس للدالة upload_to
                 if file_obj and isinstance(file_obj, (InMemoryUploadedFile, UploadedFile)):
                     # حساب الفهرس بناءً على عدد الملاك الموجودين + الملاك الجدد
-                    owner_index = len([o for o in existing.values() if o]) + len([o for o in received_ids if o]) + 1
-                    new_owner._owner_index = owner_index
-                    # حذف أي ملف سابق (احترازي) لتفادي لاحقة
-                    if new_owner.id_attachment:
-                        try:
-                            new_owner.id_attachment.delete(save=False)
-                        except Exception:
-                            pass
-                    new_owner.id_attachment = file_obj
-                    new_owner.save()
+                    new_owner._owner_index = len(existing) + len(received_ids) + len(to_create) + 1
+                    new_files.append((new_owner, file_obj))
                 
-                received_ids.append(new_owner.id)
+                to_create.append(new_owner)
+                saved_owners.append(new_owner)
+
+        if to_update:
+            # ✅ العمر يُعاد حسابه دائماً (يتغيّر مع السنة حتى بدون تعديل رقم الهوية)
+            update_fields.update(("age", "updated_at"))
+            SitePlanOwner.objects.bulk_update(to_update, sorted(update_fields))
+        if to_create:
+            SitePlanOwner.objects.bulk_create(to_create)
+        # ✅ bulk_update/bulk_create لا ترسل post_save - اسم المجلد المحفوظ يتضمن اسم المالك
+        # (قبل حفظ ملفات الهوية التي تستخدم اسم المجلد في upload_to)
+        if (to_update or to_create) and SitePlan.project.is_cached(instance):
+            invalidate_project_folder_name(instance.project)
+        stale_files = []
+        for obj, old_file_name in to_save_with_file:
+            if old_file_name:
+                # ✅ نفس الاسم الثابت (upload_to) → حذف فوري لتجنب لاحقة؛ اسم مختلف → حذف بعد نجاح الـ transaction
+                if old_file_name == obj.id_attachment.field.generate_filename(obj, obj.id_attachment.name):
+                    try:
+                        obj.id_attachment.storage.delete(old_file_name)
+                    except Exception:
+                        pass
+                else:
+                    stale_files.append(old_file_name)
+            obj.save()  # حفظ جميع الحقول (مع الملف)
+        if stale_files:
+            transaction.on_commit(functools.partial(_delete_stored_files, stale_files))
+        for new_owner, file_obj in new_files:
+            new_owner.id_attachment = file_obj
+            new_owner.save(update_fields=["id_attachment"])
+        if to_create:
+            # ✅ bulk_create لا يرسل post_save - إنشاء هيكل المجلدات (كان يتم عبر signal إضافة مالك)
+            from .signals import create_folder_structure_after_commit
+            create_folder_structure_after_commit(instance.project_id, "after adding owners", only_if_missing=True)
 
         # -----------------------------
-        # 6) حذف الملاك اللي مش ظهروا في الريكوست
+        # 6) حذف الملاك اللي مش ظهروا في الريكوست (DELETE واحد)
         # -----------------------------
-        for oid, obj in existing.items():
-            if oid not in received_ids:
-                obj.delete()
+        to_delete = existing.keys() - set(received_ids)
+        if to_delete:
+            instance.owners.filter(id__in=to_delete).delete()
 
         # -----------------------------
         # 7) تحديث اسم المشروع بعد حفظ الملاك
         # -----------------------------
-        # ✅ إعادة تحميل instance للتأكد من أحدث البيانات
-        instance.refresh_from_db()
-        self._update_project_name_from_owners(instance)
+        # ✅ بدون refresh_from_db: الاسم من الملاك المحفوظة في الذاكرة (بترتيب id)،
+        # و UpdateModelMixin يمسح prefetched owners قبل التمثيل
+        saved_owners.sort(key=lambda o: o.pk)
+        self._update_project_name_from_owners(instance, saved_owners)
         
         # -----------------------------
         # 8) تحديث الملاك في الرخصة والعقد تلقائياً
         # -----------------------------
-        self._sync_owners_to_license_and_contract(instance)
+        self._schedule_license_sync(instance)
         
         return instance
 
 
+# =========================
+# Tenant contractor info (TenantSettings)
+# =========================
+TENANT_CONTRACTOR_CACHE_TIMEOUT = 300
+_TENANT_CONTRACTOR_FIELDS = (
+    "contractor_name", "contractor_name_en", "contractor_license_no", "contractor_phone", "contractor_email",
+)
+
+
+def tenant_contractor_cache_key(tenant_id):
+    return f"tenant_contractor_info_{tenant_id}"
+
+
+def get_tenant_contractor_info(tenant_id, context=None):
+    """
+    بيانات المقاول من TenantSettings كـ dict (فارغ إذا لم تكن هناك إعدادات)
+    ✅ cache لكل tenant (يُمسح عبر signal عند حفظ/حذف TenantSettings)
+    ✅ context: memo لكل طلب - قوائم الرخص/العقود تقرأ الـ cache مرة واحدة لكل tenant
+    """
+    if not tenant_id:
+        return {}
+    memo = context.setdefault("_tenant_contractor_info", {}) if context is not None else {}
+    info = memo.get(tenant_id)
+    if info is not None:
+        return info
+    cache_key = tenant_contractor_cache_key(tenant_id)
+    info = cache.get(cache_key)
+    if info is None:
+        # ✅ values() - الحقول الخمسة فقط بدون إنشاء كائن TenantSettings (الشعار/الخلفية/الوصف...)
+        info = TenantSettings.objects.filter(tenant_id=tenant_id).values(*_TENANT_CONTRACTOR_FIELDS).first() or {}
+        cache.set(cache_key, info, TENANT_CONTRACTOR_CACHE_TIMEOUT)
+    memo[tenant_id] = info
+    return info
+
+
+def _tenant_contractor_data(tenant_id, license_field, context=None):
+    """حقول المقاول غير الفارغة بأسماء حقول الرخصة/العقد (contractor_license_no → license_field)"""
+    return {
+        (license_field if f == "contractor_license_no" else f): v
+        for f, v in get_tenant_contractor_info(tenant_id, context).items()
+        if v
+    }
+
+
 # =========================
 # Building License
 # =========================
@@ -1458,40 +1586,22 @@ class BuildingLicenseSerializer(serializers.ModelSerializer):
 
 
     def get_owners_names(self, obj):
-        snap = obj.siteplan_snapshot or {}
-        owners_data = snap.get("owners", [])
-        result = []
-        for o in owners_data:
-            ar = (o.get("owner_name_ar") or "").strip()
-            en = (o.get("owner_name_en") or "").strip()
-            if ar or en:
-                result.append({"ar": ar, "en": en})
-        return result
+        owners_data = (obj.siteplan_snapshot or {}).get("owners") or ()
+        # ✅ (ar, en) لكل مالك مرة واحدة ثم تصفية الملاك بدون اسم
+        names = (
+            ((o.get("owner_name_ar") or "").strip(), (o.get("owner_name_en") or "").strip())
+            for o in owners_data
+        )
+        return [{"ar": ar, "en": en} for ar, en in names if ar or en]
 
     def to_representation(self, instance):
         """ملء بيانات المقاول من TenantSettings عند القراءة دائماً (Single Source of Truth)"""
         representation = super().to_representation(instance)
         
-        # ✅ ملء بيانات المقاول من TenantSettings دائماً (Single Source of Truth)
+        # ✅ ملء بيانات المقاول من TenantSettings دائماً (Single Source of Truth) - cache لكل tenant
         project = instance.project
-        if project and project.tenant:
-            try:
-                from authentication.models import TenantSettings
-                tenant_settings = TenantSettings.objects.get(tenant=project.tenant)
-                
-                # ✅ نستخدم بيانات TenantSettings دائماً لضمان التحديث التلقائي
-                if tenant_settings.contractor_name:
-                    representation['contractor_name'] = tenant_settings.contractor_name
-                if tenant_settings.contractor_name_en:
-                    representation['contractor_name_en'] = tenant_settings.contractor_name_en
-                if tenant_settings.contractor_license_no:
-                    representation['contractor_license_no'] = tenant_settings.contractor_license_no
-                if tenant_settings.contractor_phone:
-                    representation['contractor_phone'] = tenant_settings.contractor_phone
-                if tenant_settings.contractor_email:
-                    representation['contractor_email'] = tenant_settings.contractor_email
-            except TenantSettings.DoesNotExist:
-                pass  # إذا لم تكن هناك إعدادات، نكمل بدون ملء البيانات
+        if project and project.tenant_id:
+            representation.update(_tenant_contractor_data(project.tenant_id, "contractor_license_no", self.context))
         
         # ✅ إضافة اسم الملف الموحد لـ building_license_file
         building_license_file = getattr(instance, 'building_license_file', None)
@@ -1505,16 +1615,24 @@ class BuildingLicenseSerializer(serializers.ModelSerializer):
     def to_internal_value(self, data):
         """دعم owners كسلسلة JSON في multipart: owners='[{"owner_name_ar":"..."}, ...]'"""
         ret = super().to_internal_value(data)
-        owners_raw = self.initial_data.get("owners")
-        if isinstance(owners_raw, str):
-            try:
-                parsed = json.loads(owners_raw)
-                if isinstance(parsed, list):
-                    ret["owners"] = parsed
-            except Exception:
-                pass
+        owners = self._parsed_owners()
+        if owners is not None:
+            ret["owners"] = owners
         return ret
 
+    def _parsed_owners(self):
+        """✅ owners من initial_data (نص JSON) - تُحلل مرة واحدة لكل serializer (orjson إذا كان مثبتاً)"""
+        if '_parsed_owners_cache' not in self.__dict__:
+            parsed = None
+            owners_raw = self.initial_data.get("owners")
+            if isinstance(owners_raw, str):
+                try:
+                    parsed = _json_loads(owners_raw)
+                except ValueError:
+                    pass
+            self.__dict__['_parsed_owners_cache'] = parsed if isinstance(parsed, list) else None
+        return self.__dict__['_parsed_owners_cache']
+
     def validate(self, attrs):
         issue = attrs.get("issue_date") or getattr(self.instance, "issue_date", None)
         last  = attrs.get("last_issue_date") or getattr(self.instance, "last_issue_date", None)
@@ -1525,55 +1643,25 @@ class BuildingLicenseSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # ✅ ملء بيانات المقاول من TenantSettings تلقائياً إذا لم تكن موجودة
         project = validated_data.get('project')
-        if project and project.tenant:
-            try:
-                from authentication.models import TenantSettings
-                tenant_settings = TenantSettings.objects.get(tenant=project.tenant)
-                # ✅ ملء بيانات المقاول من TenantSettings إذا كانت فارغة
-                if not validated_data.get('contractor_name') and tenant_settings.contractor_name:
-                    validated_data['contractor_name'] = tenant_settings.contractor_name
-                if not validated_data.get('contractor_name_en') and tenant_settings.contractor_name_en:
-                    validated_data['contractor_name_en'] = tenant_settings.contractor_name_en
-                if not validated_data.get('contractor_license_no') and tenant_settings.contractor_license_no:
-                    validated_data['contractor_license_no'] = tenant_settings.contractor_license_no
-                if not validated_data.get('contractor_phone') and tenant_settings.contractor_phone:
-                    validated_data['contractor_phone'] = tenant_settings.contractor_phone
-                if not validated_data.get('contractor_email') and tenant_settings.contractor_email:
-                    validated_data['contractor_email'] = tenant_settings.contractor_email
-            except TenantSettings.DoesNotExist:
-                pass  # إذا لم تكن هناك إعدادات، نكمل بدون ملء البيانات
-        
-        lic = BuildingLicense.objects.create(**validated_data)
+        if project and project.tenant_id:
+            for field, value in _tenant_contractor_data(project.tenant_id, "contractor_license_no", self.context).items():
+                if not validated_data.get(field):
+                    validated_data[field] = value
+        
+        # ✅ snapshot الـ SitePlan يُحسب قبل الإنشاء ويُحفظ مع الرخصة في INSERT واحد
         try:
-            sp = lic.project.siteplan
+            sp = project.siteplan if project else None
         except SitePlan.DoesNotExist:
             sp = None
         if sp:
-            lic.siteplan_snapshot = build_siteplan_snapshot(sp)
-            lic.save(update_fields=["siteplan_snapshot"])
-        return lic
+            validated_data["siteplan_snapshot"] = build_siteplan_snapshot(sp, self.context)
+        return BuildingLicense.objects.create(**validated_data)
 
     def update(self, instance, validated_data):
         # ✅ ملء بيانات المقاول من TenantSettings تلقائياً إذا لم تكن موجودة أو تم تحديثها
         project = instance.project
-        if project and project.tenant:
-            try:
-                from authentication.models import TenantSettings
-                tenant_settings = TenantSettings.objects.get(tenant=project.tenant)
-                # ✅ ملء بيانات المقاول من TenantSettings إذا كانت فارغة
-                # ✅ نستخدم بيانات TenantSettings دائماً لضمان التحديث التلقائي
-                if tenant_settings.contractor_name:
-                    validated_data['contractor_name'] = tenant_settings.contractor_name
-                if tenant_settings.contractor_name_en:
-                    validated_data['contractor_name_en'] = tenant_settings.contractor_name_en
-                if tenant_settings.contractor_license_no:
-                    validated_data['contractor_license_no'] = tenant_settings.contractor_license_no
-                if tenant_settings.contractor_phone:
-                    validated_data['contractor_phone'] = tenant_settings.contractor_phone
-                if tenant_settings.contractor_email:
-                    validated_data['contractor_email'] = tenant_settings.contractor_email
-            except TenantSettings.DoesNotExist:
-                pass  # إذا لم تكن هناك إعدادات، نكمل بدون ملء البيانات
+        if project and project.tenant_id:
+            validated_data.update(_tenant_contractor_data(project.tenant_id, "contractor_license_no", self.context))
         
         # ✅ استعادة الملاك من حقل owners إلى Site Plan إذا لم تكن موجودة
         owners_data = validated_data.get("owners")
@@ -1585,50 +1673,10 @@ class BuildingLicenseSerializer(serializers.ModelSerializer):
                 
                 # ✅ إذا لم يكن هناك ملاك في Site Plan، نستعيدهم من الرخصة
                 if existing_owners_count == 0:
-                    from datetime import datetime
-                    from decimal import Decimal
-                    
+                    new_owners = []
                     for owner_data in owners_data:
-                        # ✅ تحويل التواريخ من string إلى date objects
-                        id_issue_date = None
-                        id_expiry_date = None
-                        if owner_data.get("id_issue_date"):
-                            try:
-                                if isinstance(owner_data["id_issue_date"], str):
-                                    id_issue_date = datetime.fromisoformat(owner_data["id_issue_date"].replace('Z', '+00:00')).date()
-                                else:
-                                    id_issue_date = owner_data["id_issue_date"]
-                            except:
-                                pass
-                        
-                        if owner_data.get("id_expiry_date"):
-                            try:
-                                if isinstance(owner_data["id_expiry_date"], str):
-                                    id_expiry_date = datetime.fromisoformat(owner_data["id_expiry_date"].replace('Z', '+00:00')).date()
-                                else:
-                                    id_expiry_date = owner_data["id_expiry_date"]
-                            except:
-                                pass
-                        
-                        # ✅ تحويل share_percent إلى Decimal
-                        share_percent = owner_data.get("share_percent", "100.00")
-                        if isinstance(share_percent, str):
-                            try:
-                                share_percent = Decimal(share_percent)
-                            except:
-                                share_percent = Decimal("100.00")
-                        elif not isinstance(share_percent, Decimal):
-                            share_percent = Decimal(str(share_percent))
-                        
-                        # ✅ تحويل is_authorized إلى boolean
-                        is_authorized = owner_data.get("is_authorized", False)
-                        if isinstance(is_authorized, str):
-                            is_authorized = is_authorized.lower() in ("true", "1", "yes")
-                        elif not isinstance(is_authorized, bool):
-                            is_authorized = bool(is_authorized)
-                        
-                        # ✅ إنشاء المالك في Site Plan
-                        SitePlanOwner.objects.create(
+                        # ✅ المالك يُجمع ثم يُدرج مع الباقين في INSERT واحد
+                        owner = SitePlanOwner(
                             siteplan=siteplan,
                             owner_name_ar=owner_data.get("owner_name_ar", ""),
                             owner_name_en=owner_data.get("owner_name_en", ""),
@@ -1636,30 +1684,32 @@ class BuildingLicenseSerializer(serializers.ModelSerializer):
                             phone=owner_data.get("phone", ""),
                             email=owner_data.get("email", ""),
                             id_number=owner_data.get("id_number", ""),
-                            id_issue_date=id_issue_date,
-                            id_expiry_date=id_expiry_date,
+                            id_issue_date=_parse_date(owner_data.get("id_issue_date")),
+                            id_expiry_date=_parse_date(owner_data.get("id_expiry_date")),
                             right_hold_type=owner_data.get("right_hold_type", "Ownership"),
                             share_possession=owner_data.get("share_possession", ""),
-                            share_percent=share_percent,
-                            is_authorized=is_authorized,  # ✅ المالك المفوض
+                            share_percent=_parse_decimal(owner_data.get("share_percent")),
+                            is_authorized=_parse_bool(owner_data.get("is_authorized", False)),  # ✅ المالك المفوض
                         )
+                        # bulk_create لا يستدعي save() - نحسب العمر هنا
+                        owner.age = owner.calculate_age_from_id()
+                        new_owners.append(owner)
+                    
+                    SitePlanOwner.objects.bulk_create(new_owners)
+                    # ✅ bulk_create لا يرسل post_save - إنشاء هيكل المجلدات (كان يتم عبر signal إضافة مالك)
+                    from .signals import create_folder_structure_after_commit
+                    create_folder_structure_after_commit(siteplan.project_id, "after restoring owners", only_if_missing=True)
                     
-                    # ✅ تحديث اسم المشروع بعد استعادة الملاك
-                    siteplan.refresh_from_db()
-                    # ✅ استخدام نفس الدالة من SitePlanSerializer (instance method)
-                    serializer_instance = SitePlanSerializer()
-                    serializer_instance._update_project_name_from_owners(siteplan)
+                    # ✅ تحديث اسم المشروع بعد استعادة الملاك (من الملاك في الذاكرة - بدون استعلام)
+                    SitePlanSerializer()._update_project_name_from_owners(siteplan, new_owners)
                     
-                    # ✅ تحديث snapshot في الرخصة
-                    instance.siteplan_snapshot = build_siteplan_snapshot(siteplan)
-                    instance.save(update_fields=["siteplan_snapshot"])
+                    # ✅ snapshot الرخصة يُحفظ مع باقي الحقول في super().update (UPDATE واحد)
+                    validated_data["siteplan_snapshot"] = build_siteplan_snapshot(siteplan, self.context)
                     
             except SitePlan.DoesNotExist:
                 pass
             except Exception as e:
                 # ✅ في حالة الخطأ، نكمل التحديث العادي
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"Error restoring owners from license to siteplan: {e}")
         
         # ✅ التعامل مع ملف رخصة البناء لتجنب إضافة لاحقة على الاسم
@@ -1812,8 +1862,6 @@ class ContractSerializer(serializers.ModelSerializer):
 
     def to_internal_value(self, data):
         """دعم owners كسلسلة JSON في multipart: owners='[{"owner_name_ar":"..."}, ...]'"""
-        import logging
-        logger = logging.getLogger(__name__)
         
         # ✅ استخراج owners من البيانات أولاً قبل أي تعديل
         # ⚠️ لا نستخدم copy() لأن QueryDict قد يحتوي على ملفات غير قابلة للنسخ (BufferedRandom)
@@ -1844,6 +1892,8 @@ class ContractSerializer(serializers.ModelSerializer):
                         buckets = {}
                         for k in post_data.keys():
                             k_str = str(k)
+                            if not k_str.startswith("owners["):
+                                continue
                             m = self._owners_key_re.match(k_str)
                             if m:
                                 idx = int(m.group(1))
@@ -2019,28 +2069,39 @@ class ContractSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         """ملء بيانات المقاول من TenantSettings عند القراءة دائماً (Single Source of Truth)"""
-        representation = super().to_representation(instance)
+        representation = self._cached_base_representation(instance)
         
-        # ✅ ملء بيانات المقاول من TenantSettings دائماً (Single Source of Truth)
+        # ✅ ملء بيانات المقاول من TenantSettings دائماً (Single Source of Truth) - cache لكل tenant
         project = instance.project
-        if project and project.tenant:
-            try:
-                from authentication.models import TenantSettings
-                tenant_settings = TenantSettings.objects.get(tenant=project.tenant)
-                
-                # ✅ نستخدم بيانات TenantSettings دائماً لضمان التحديث التلقائي
-                if tenant_settings.contractor_name:
-                    representation['contractor_name'] = tenant_settings.contractor_name
-                if tenant_settings.contractor_name_en:
-                    representation['contractor_name_en'] = tenant_settings.contractor_name_en
-                if tenant_settings.contractor_license_no:
-                    representation['contractor_trade_license'] = tenant_settings.contractor_license_no
-                if tenant_settings.contractor_phone:
-                    representation['contractor_phone'] = tenant_settings.contractor_phone
-                if tenant_settings.contractor_email:
-                    representation['contractor_email'] = tenant_settings.contractor_email
-            except TenantSettings.DoesNotExist:
-                pass  # إذا لم تكن هناك إعدادات، نكمل بدون ملء البيانات
+        if project and project.tenant_id:
+            representation.update(_tenant_contractor_data(project.tenant_id, "contractor_trade_license", self.context))
+        
+        return representation
+    
+    def _cached_base_representation(self, instance):
+        """
+        ✅ تمثيل العقد (روابط الملفات + أسماؤها + المرفقات) مخزن في cache
+        المفتاح يتضمن updated_at - أي حفظ للعقد يُنشئ مفتاحاً جديداً تلقائياً
+        بيانات المقاول من TenantSettings لا تُخزن (قد تتغير بدون تعديل العقد)
+        """
+        updated_at = getattr(instance, 'updated_at', None)
+        if not instance.pk or not updated_at:
+            return self._build_base_representation(instance)
+        request = self.context.get('request')
+        base_uri = request.build_absolute_uri('/') if request else ''
+        # ✅ مدة التخزين = الصلاحية المتبقية للروابط الموقّعة (انظر url_payload_cache_timeout)
+        timeout = url_payload_cache_timeout(3000)
+        if not timeout:
+            return self._build_base_representation(instance)
+        cache_key = f"contract_repr:{instance.pk}:{updated_at.timestamp()}:{base_uri}"
+        representation = cache.get(cache_key)
+        if representation is None:
+            representation = self._build_base_representation(instance)
+            cache.set(cache_key, representation, timeout)
+        return representation
+    
+    def _build_base_representation(self, instance):
+        representation = super().to_representation(instance)
         
         # ✅ إضافة أسماء الملفات الموحدة لجميع ملفات Contract
         contract_file = getattr(instance, 'contract_file', None)
@@ -2144,6 +2205,64 @@ class ContractSerializer(serializers.ModelSerializer):
         # ✅ إرجاع الاسم الموحد مع الامتداد
         return f"{standard_name}{ext}"
 
+    def _save_files_concurrently(self, obj, files):
+        """
+        ✅ رفع ملفات العقد ثم تحديث الحقول بـ UPDATE واحد
+        ✅ أسماء الملفات تُحسب في الـ thread الحالي (upload_to يستعلم من قاعدة البيانات)
+        - التوازي فقط للـ storage البعيد (S3)؛ FileSystemStorage محلي - لا فائدة من الـ threads
+        - عند أي فشل تُحذف الملفات التي رُفعت بنجاح ويُعاد رفع الخطأ (بدون إعادة رفع عمياء)
+        files: {field_name: uploaded_file}
+        """
+        jobs = []
+        for field_name, file_obj in files.items():
+            field = obj._meta.get_field(field_name)
+            jobs.append((field_name, field, field.generate_filename(obj, file_obj.name), file_obj))
+
+        def _store(field, name, file_obj):
+            return field.storage.save(name, file_obj, max_length=field.max_length)
+
+        stored = {}
+        error = None
+        remote = any(not isinstance(field.storage, FileSystemStorage) for _, field, _, _ in jobs)
+        if remote and len(jobs) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            from django.db import connection as _worker_connection
+
+            def _store_in_worker(field, name, file_obj):
+                try:
+                    return _store(field, name, file_obj)
+                finally:
+                    # ✅ إغلاق اتصال قاعدة البيانات الخاص بالـ thread إن فُتح
+                    _worker_connection.close()
+
+            with ThreadPoolExecutor(max_workers=min(8, len(jobs))) as pool:
+                futures = {
+                    field_name: pool.submit(_store_in_worker, field, name, file_obj)
+                    for field_name, field, name, file_obj in jobs
+                }
+            for field_name, future in futures.items():
+                try:
+                    stored[field_name] = future.result()
+                except Exception as e:
+                    error = error or e
+        else:
+            for field_name, field, name, file_obj in jobs:
+                try:
+                    stored[field_name] = _store(field, name, file_obj)
+                except Exception as e:
+                    error = e
+                    break
+
+        if error is not None:
+            # ✅ لا نترك ملفات يتيمة من الرفع الجزئي
+            for field_name, name in stored.items():
+                _delete_stored_files([name], obj._meta.get_field(field_name).storage)
+            raise error
+
+        for field_name, name in stored.items():
+            setattr(obj, field_name, name)
+        obj.save(update_fields=list(stored))
+
     def _fill_snapshot(self, contract: Contract):
         try:
             lic = contract.project.license
@@ -2157,8 +2276,6 @@ class ContractSerializer(serializers.ModelSerializer):
             contract.save(update_fields=["license_snapshot"])
         except Exception as e:
             # ✅ في حالة أي خطأ، نضع snapshot فارغ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error building license snapshot: {e}", exc_info=True)
             contract.license_snapshot = {}
             contract.save(update_fields=["license_snapshot"])
@@ -2166,32 +2283,28 @@ class ContractSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # ✅ ملء بيانات المقاول من TenantSettings تلقائياً إذا لم تكن موجودة
         project = validated_data.get('project')
-        if project and project.tenant:
-            try:
-                from authentication.models import TenantSettings
-                tenant_settings = TenantSettings.objects.get(tenant=project.tenant)
-                # ✅ ملء بيانات المقاول من TenantSettings إذا كانت فارغة
-                if not validated_data.get('contractor_name') and tenant_settings.contractor_name:
-                    validated_data['contractor_name'] = tenant_settings.contractor_name
-                if not validated_data.get('contractor_name_en') and tenant_settings.contractor_name_en:
-                    validated_data['contractor_name_en'] = tenant_settings.contractor_name_en
-                if not validated_data.get('contractor_trade_license') and tenant_settings.contractor_license_no:
-                    validated_data['contractor_trade_license'] = tenant_settings.contractor_license_no
-                if not validated_data.get('contractor_phone') and tenant_settings.contractor_phone:
-                    validated_data['contractor_phone'] = tenant_settings.contractor_phone
-                if not validated_data.get('contractor_email') and tenant_settings.contractor_email:
-                    validated_data['contractor_email'] = tenant_settings.contractor_email
-            except TenantSettings.DoesNotExist:
-                pass  # إذا لم تكن هناك إعدادات، نكمل بدون ملء البيانات
+        if project and project.tenant_id:
+            for field, value in _tenant_contractor_data(project.tenant_id, "contractor_trade_license", self.context).items():
+                if not validated_data.get(field):
+                    validated_data[field] = value
         
         # ✅ حفظ owners في قاعدة البيانات (قابلة للتحرير)
         owners_data = validated_data.pop("owners", [])
         attachments_data = validated_data.pop("attachments", [])
         # ✅ تم نقل extensions إلى StartOrder - لا نحفظها هنا
+        # ✅ فصل الملفات عن الإنشاء لرفعها بالتوازي بعد الحصول على pk
+        pending_files = {
+            f.name: validated_data.pop(f.name)
+            for f in Contract._meta.concrete_fields
+            if isinstance(f, models.FileField) and validated_data.get(f.name)
+        }
         
         try:
             obj = Contract.objects.create(**validated_data)
             
+            if pending_files:
+                self._save_files_concurrently(obj, pending_files)
+            
             # ✅ حفظ owners في قاعدة البيانات
             if owners_data and isinstance(owners_data, list):
                 obj.owners = owners_data
@@ -2209,8 +2322,6 @@ class ContractSerializer(serializers.ModelSerializer):
                         elif hasattr(req, 'FILES'):
                             files_data = req.FILES
                     except Exception as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
                         logger.warning(f"Error extracting attachment files in create: {e}")
                 
                 # ✅ ربط الملفات بالمرفقات
@@ -2222,8 +2333,6 @@ class ContractSerializer(serializers.ModelSerializer):
                             idx = int(match.group(1))
                             if idx < len(attachments_data):
                                 attachments_data[idx]["_file"] = files_data.get(key)
-                                import logging
-                                logger = logging.getLogger(__name__)
                                 logger.info(f"✅ Linked file to attachment[{idx}]: {files_data.get(key).name if files_data.get(key) else 'None'}")
                 
                 saved_attachments = []
@@ -2263,8 +2372,6 @@ class ContractSerializer(serializers.ModelSerializer):
                         att_dict["file_url"] = normalize_file_url(att.get("file_url"))
                         att_dict["file_name"] = att.get("file_name")
                     else:
-                        import logging
-                        logger = logging.getLogger(__name__)
                         logger.warning(f"⚠️ Attachment[{idx}] has no file: type={att.get('type')}, _file={'_file' in att}, file_url={att.get('file_url')}")
                     saved_attachments.append(att_dict)
                 obj.attachments = saved_attachments
@@ -2274,36 +2381,17 @@ class ContractSerializer(serializers.ModelSerializer):
             try:
                 self._fill_snapshot(obj)
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"Error filling snapshot in create: {e}", exc_info=True)
             return obj
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error creating contract: {e}", exc_info=True)
             raise
 
     def update(self, instance, validated_data):
         # ✅ ملء بيانات المقاول من TenantSettings تلقائياً (تحديث تلقائي)
         project = instance.project
-        if project and project.tenant:
-            try:
-                from authentication.models import TenantSettings
-                tenant_settings = TenantSettings.objects.get(tenant=project.tenant)
-                # ✅ نستخدم بيانات TenantSettings دائماً لضمان التحديث التلقائي
-                if tenant_settings.contractor_name:
-                    validated_data['contractor_name'] = tenant_settings.contractor_name
-                if tenant_settings.contractor_name_en:
-                    validated_data['contractor_name_en'] = tenant_settings.contractor_name_en
-                if tenant_settings.contractor_license_no:
-                    validated_data['contractor_trade_license'] = tenant_settings.contractor_license_no
-                if tenant_settings.contractor_phone:
-                    validated_data['contractor_phone'] = tenant_settings.contractor_phone
-                if tenant_settings.contractor_email:
-                    validated_data['contractor_email'] = tenant_settings.contractor_email
-            except TenantSettings.DoesNotExist:
-                pass  # إذا لم تكن هناك إعدادات، نكمل بدون ملء البيانات
+        if project and project.tenant_id:
+            validated_data.update(_tenant_contractor_data(project.tenant_id, "contractor_trade_license", self.context))
         
         # ✅ تحديث owners في قاعدة البيانات (قابلة للتحرير)
         owners_data = validated_data.pop("owners", None)
@@ -2330,14 +2418,10 @@ class ContractSerializer(serializers.ModelSerializer):
                         elif hasattr(req, 'FILES'):
                             files_data = req.FILES
                     except Exception as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
                         logger.warning(f"Error extracting attachment files in update: {e}")
                 
                 # ✅ ربط الملفات بالمرفقات
                 if files_data:
-                    import logging
-                    logger = logging.getLogger(__name__)
                     logger.info(f"🔍 Found {len(files_data)} files in FormData (update)")
                     for key in files_data.keys():
                         logger.info(f"🔍 FormData key (update): {key}")
@@ -2356,8 +2440,6 @@ class ContractSerializer(serializers.ModelSerializer):
                 
                 saved_attachments = []
                 for idx, att in enumerate(attachments_data):
-                    import logging
-                    logger = logging.getLogger(__name__)
                     logger.info(f"🔍 Processing attachment[{idx}] (update): type={att.get('type')}, has_file={'_file' in att}, file_url={att.get('file_url')}")
                     
                     # ✅ الحصول على attachment القديم من instance إذا كان موجوداً
@@ -2433,13 +2515,9 @@ class ContractSerializer(serializers.ModelSerializer):
             try:
                 self._fill_snapshot(updated)
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"Error filling snapshot in update: {e}", exc_info=True)
             return updated
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error updating contract: {e}", exc_info=True)
             raise
 
@@ -2557,8 +2635,6 @@ class StartOrderSerializer(serializers.ModelSerializer):
             
             return end_date
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error calculating project_end_date: {e}", exc_info=True)
             return None
     
@@ -2862,8 +2938,6 @@ class ProjectScheduleSerializer(serializers.ModelSerializer):
             return None
         
         from datetime import timedelta
-        import logging
-        logger = logging.getLogger(__name__)
         
         try:
             # ✅ استخدام relativedelta إذا كان متوفراً، وإلا حساب يدوي للأشهر
@@ -3036,31 +3110,13 @@ class VariationSerializer(serializers.ModelSerializer):
         return data
     
     def create(self, validated_data):
-        """Auto-generate variation_number if not provided and calculate consultant_fees from percentage"""
+        """Auto-generate variation_number if not provided"""
         if not validated_data.get('variation_number'):
             # Generate unique variation number
             import uuid
             validated_data['variation_number'] = f"VAR-{uuid.uuid4().hex[:8].upper()}"
         
-        # Calculate consultant_fees from percentage if provided
-        if 'consultant_fees_percentage' in validated_data and 'final_amount' in validated_data:
-            from decimal import Decimal
-            final_amount = validated_data.get('final_amount', Decimal('0'))
-            percentage = validated_data.get('consultant_fees_percentage', Decimal('0'))
-            validated_data['consultant_fees'] = final_amount * (percentage / Decimal('100'))
-        
         return super().create(validated_data)
-    
-    def update(self, instance, validated_data):
-        """Calculate consultant_fees from percentage if percentage is updated"""
-        # Calculate consultant_fees from percentage if percentage is provided
-        if 'consultant_fees_percentage' in validated_data:
-            from decimal import Decimal
-            final_amount = validated_data.get('final_amount', instance.final_amount)
-            percentage = validated_data.get('consultant_fees_percentage', Decimal('0'))
-            validated_data['consultant_fees'] = final_amount * (percentage / Decimal('100'))
-        
-        return super().update(instance, validated_data)
 
 
 # =========================
@@ -3087,8 +3143,6 @@ class ActualInvoiceSerializer(serializers.ModelSerializer):
             data = super().to_representation(instance)
         except Exception as e:
             # ✅ Handle case where items field doesn't exist in database
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Error in to_representation for ActualInvoice {instance.id}: {e}")
             # Try to get basic fields manually
             data = {
@@ -3177,6 +3231,12 @@ class ActualInvoiceSerializer(serializers.ModelSerializer):
 # =========================
 # Payment
 # =========================
+# ✅ نص رسالة الخطأ بترتيب PAYMENT_METHOD_CHOICES (frozenset بدون ترتيب)
+_OWNER_VALID_METHODS_DISPLAY = ", ".join(
+    method for method, _ in Payment.PAYMENT_METHOD_CHOICES if method in Payment.OWNER_VALID_METHODS
+)
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     project_name = serializers.SerializerMethodField()
     actual_invoice_id = serializers.SerializerMethodField()
@@ -3291,10 +3351,9 @@ class PaymentSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({
                     'payment_method': 'Payment method is required for owner payments.'
                 })
-            valid_methods = ['cash_deposit', 'cash_office', 'bank_transfer', 'bank_cheque']
-            if payment_method not in valid_methods:
+            if payment_method not in Payment.OWNER_VALID_METHODS:
                 raise serializers.ValidationError({
-                    'payment_method': f'Invalid payment method. Must be one of: {", ".join(valid_methods)}'
+                    'payment_method': f'Invalid payment method. Must be one of: {_OWNER_VALID_METHODS_DISPLAY}'
                 })
         
         return data
@@ -3311,26 +3370,11 @@ class PaymentSerializer(serializers.ModelSerializer):
             if project.name and project.name.strip():
                 return project.name
             
-            # ✅ إذا لم يكن هناك اسم محفوظ، نحاول حسابه من الملاك
-            try:
-                sp = project.siteplan
-            except SitePlan.DoesNotExist:
-                sp = None
-
-            main_name = ""
-            owners_count = 0
-            if sp:
-                qs = sp.owners.order_by("id")
-                owners_count = qs.count()
-                for o in qs:
-                    ar = (o.owner_name_ar or "").strip()
-                    en = (o.owner_name_en or "").strip()
-                    if ar or en:
-                        main_name = ar or en
-                        break
-
-            if main_name:
-                return f"{main_name} وشركاؤه" if owners_count > 1 else main_name
+            # ✅ إذا لم يكن هناك اسم محفوظ، نحاول حسابه من الملاك (values_list - بدون إنشاء كائنات SitePlanOwner)
+            siteplan_id = SitePlan.objects.filter(project_id=project.id).values_list('id', flat=True).first()
+            display_name = SitePlanOwner.display_name_for(siteplan_id) if siteplan_id else ""
+            if display_name:
+                return display_name
             
             # ✅ إذا لم يكن هناك اسم ولا ملاك، نستخدم ID
             project_id = getattr(project, 'id', None)
@@ -3339,8 +3383,6 @@ class PaymentSerializer(serializers.ModelSerializer):
             return "مشروع جديد"
         except Exception as e:
             # ✅ في حالة أي خطأ، نرجع اسم بسيط
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error getting project name in PaymentSerializer: {e}")
             if obj.project:
                 return obj.project.name or f"Project #{obj.project.id}"
@@ -3386,8 +3428,6 @@ class ConsultantSerializer(serializers.ModelSerializer):
                 return obj.projects.count()
             return 0
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Error getting projects count for consultant {obj.id}: {e}")
             return 0
     
@@ -3395,10 +3435,6 @@ class ConsultantSerializer(serializers.ModelSerializer):
         """قائمة المشاريع المرتبطة مع أدوار الاستشاري"""
         from .models import ProjectConsultant
         projects_data = []
-        ROLE_CHOICES = [
-            ('design', 'استشاري التصميم'),
-            ('supervision', 'استشاري الإشراف'),
-        ]
         try:
             if hasattr(obj, 'projects'):
                 for pc in obj.projects.all():
@@ -3407,17 +3443,13 @@ class ConsultantSerializer(serializers.ModelSerializer):
                             "project_id": pc.project.id,
                             "project_name": pc.project.name or f"Project #{pc.project.id}",
                             "role": pc.role,
-                            "role_display": dict(ROLE_CHOICES).get(pc.role, pc.role),
+                            "role_display": ProjectConsultant._ROLE_MAP.get(pc.role, pc.role),
                         })
                     except Exception as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
                         logger.warning(f"Error processing project consultant {pc.id}: {e}")
                         continue
         except Exception as e:
             # في حالة عدم وجود projects related، نرجع قائمة فارغة
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Error getting projects for consultant {obj.id if hasattr(obj, 'id') else 'unknown'}: {e}")
         return projects_data
     
@@ -3,11 +3,14 @@ Django signals لتحديث حالة المشروع تلقائياً بناءً
 وإنشاء هيكل المجلدات للمشاريع الجديدة
 """
 import logging
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from .models import Payment, Project, SitePlan, SitePlanOwner
-from .utils import create_project_folder_structure, get_project_folder_name
+from .utils import create_project_folder_structure, get_project_folder_name, invalidate_project_folder_name, on_commit_once
+from django.core.cache import cache
 from django.core.files.storage import default_storage
+from authentication.models import TenantSettings
 import os
 
 logger = logging.getLogger(__name__)
@@ -39,6 +42,83 @@ def create_project_folder_structure_on_create(sender, instance, created, **kwarg
     pass
 
 
+@receiver(post_save, sender=Project)
+def invalidate_folder_name_on_project_save(sender, instance, **kwargs):
+    """حذف اسم المجلد المحفوظ على المشروع (قد يتغير internal_code)"""
+    invalidate_project_folder_name(instance)
+
+
+@receiver(post_save, sender=SitePlanOwner)
+@receiver(post_delete, sender=SitePlanOwner)
+def invalidate_folder_name_on_owner_change(sender, instance, **kwargs):
+    """
+    حذف اسم المجلد المحفوظ على المشروع عند تغيّر الملاك (اسم المالك جزء من اسم المجلد)
+    ✅ فقط إذا كان المشروع محمّلاً بالفعل (بدون استعلامات إضافية)
+    """
+    if not SitePlanOwner.siteplan.is_cached(instance):
+        return
+    siteplan = instance.siteplan
+    if siteplan is not None and SitePlan.project.is_cached(siteplan):
+        invalidate_project_folder_name(siteplan.project)
+
+
+@receiver(post_save, sender=SitePlanOwner)
+@receiver(post_delete, sender=SitePlanOwner)
+def sync_project_name_on_owner_change(sender, instance, origin=None, **kwargs):
+    """
+    ✅ Project.name هو اسم العرض المخزن (المالك المفوض + "وشركاؤه")
+    يُعاد حسابه بعد نجاح الـ transaction عند إضافة/تعديل/حذف مالك
+    ✅ مرة واحدة لكل SitePlan في الـ transaction (وليس لكل صف مالك)
+    """
+    # ✅ الملاك محذوفون ضمن حذف المشروع/SitePlan نفسه (cascade) - لا داعي لإعادة الحساب
+    if isinstance(origin, (Project, SitePlan)) or getattr(origin, 'model', None) in (Project, SitePlan):
+        return
+    siteplan_id = instance.siteplan_id
+    if not siteplan_id:
+        return
+
+    def _run():
+        new_name = SitePlanOwner.display_name_for(siteplan_id)
+        if not new_name:
+            return
+        project = Project.objects.filter(siteplan__id=siteplan_id).first()
+        # ✅ SitePlanSerializer يحدّث الاسم بنفسه - هنا فقط للمسارات الأخرى (admin/views/shell)
+        if project is not None and project.name != new_name:
+            project.name = new_name
+            project.save(update_fields=['name'])
+
+    on_commit_once(('project_name', siteplan_id), _run)
+
+
+def create_folder_structure_after_commit(project_id, reason, only_if_missing=False):
+    """
+    ✅ إنشاء هيكل المجلدات بعد نجاح الـ transaction (وليس داخل حفظ الملفات نفسه)
+    - لا يُنفَّذ إذا تم التراجع عن الحفظ
+    - only_if_missing: لا ننشئ شيئاً إذا كان مجلد المشروع موجوداً
+    """
+    def _run():
+        try:
+            project = Project.objects.filter(pk=project_id).first()
+            if project is None:
+                return
+            if only_if_missing:
+                project_folder = get_project_folder_name(project)
+                try:
+                    default_storage.listdir(f'projects/{project_folder}')
+                    return  # المجلد موجود بالفعل
+                except (OSError, FileNotFoundError):
+                    pass
+            logger.info(f"📁 Creating folder structure for project {project_id} {reason}")
+            if create_project_folder_structure(project):
+                logger.info(f"✅ Successfully created folder structure for project {project_id}")
+            else:
+                logger.warning(f"⚠️ Failed to create folder structure for project {project_id}")
+        except Exception as e:
+            logger.error(f"❌ Error creating folder structure for project {project_id}: {e}", exc_info=True)
+
+    transaction.on_commit(_run)
+
+
 @receiver(post_save, sender=SitePlan)
 def create_project_folder_on_siteplan_create(sender, instance, created, **kwargs):
     """
@@ -46,18 +126,8 @@ def create_project_folder_on_siteplan_create(sender, instance, created, **kwargs
     هذا يضمن أن المجلد يُنشأ مرة واحدة فقط عندما يكون هناك owners
     """
     if created and instance and instance.project_id:
-        try:
-            # التحقق من وجود owners
-            owners_count = SitePlanOwner.objects.filter(siteplan=instance).count()
-            if owners_count > 0:
-                logger.info(f"📁 Creating folder structure for project {instance.project_id} after SitePlan creation with owners")
-                success = create_project_folder_structure(instance.project)
-                if success:
-                    logger.info(f"✅ Successfully created folder structure for project {instance.project_id}")
-                else:
-                    logger.warning(f"⚠️ Failed to create folder structure for project {instance.project_id}")
-        except Exception as e:
-            logger.error(f"❌ Error creating folder structure for project {instance.project_id}: {e}", exc_info=True)
+        if SitePlanOwner.objects.filter(siteplan=instance).exists():
+            create_folder_structure_after_commit(instance.project_id, "after SitePlan creation with owners")
 
 
 @receiver(post_save, sender=SitePlanOwner)
@@ -65,28 +135,10 @@ def ensure_project_folder_on_owner_create(sender, instance, created, **kwargs):
     """
     التأكد من وجود هيكل المجلدات عند إضافة owner جديد
     """
-    if created and instance and instance.siteplan and instance.siteplan.project_id:
-        try:
-            project = instance.siteplan.project
-            # التحقق من وجود المجلد
-            project_folder = get_project_folder_name(project)
-            folder_path = f'projects/{project_folder}'
-            
-            # التحقق من وجود المجلد
-            try:
-                listdir_result = default_storage.listdir(folder_path)
-                folder_exists = True
-            except (OSError, FileNotFoundError):
-                folder_exists = False
-            
-            if not folder_exists:
-                # المجلد غير موجود - إنشاؤه
-                logger.info(f"📁 Creating folder structure for project {project.id} after adding owner")
-                success = create_project_folder_structure(project)
-                if success:
-                    logger.info(f"✅ Successfully created folder structure for project {project.id}")
-        except Exception as e:
-            logger.debug(f"Error checking folder structure for project {instance.siteplan.project_id}: {e}")
+    if created and instance and instance.siteplan_id:
+        project_id = SitePlan.objects.filter(pk=instance.siteplan_id).values_list('project_id', flat=True).first()
+        if project_id:
+            create_folder_structure_after_commit(project_id, "after adding owner", only_if_missing=True)
 
 
 @receiver(post_save, sender=Payment)
@@ -105,8 +157,11 @@ def update_project_status_on_payment_save(sender, instance, created, **kwargs):
 
 
 @receiver(post_delete, sender=Payment)
-def update_project_status_on_payment_delete(sender, instance, **kwargs):
+def update_project_status_on_payment_delete(sender, instance, origin=None, **kwargs):
     """تحديث حالة المشروع عند حذف دفعة"""
+    # ✅ الدفعة محذوفة ضمن حذف المشروع نفسه (cascade) - لا داعي لإعادة حساب الحالة لكل دفعة
+    if isinstance(origin, Project) or getattr(origin, 'model', None) is Project:
+        return
     if instance and instance.project_id:
         try:
             # ✅ إعادة تحميل المشروع من قاعدة البيانات
@@ -117,3 +172,11 @@ def update_project_status_on_payment_delete(sender, instance, **kwargs):
             pass
         except Exception as e:
             logger.error(f"Error updating project status on payment delete: {e}", exc_info=True)
+
+
+@receiver(post_save, sender=TenantSettings)
+@receiver(post_delete, sender=TenantSettings)
+def invalidate_tenant_contractor_info(sender, instance, **kwargs):
+    """مسح بيانات المقاول المخزنة في cache (تُستخدم في الرخصة/العقد) عند تعديل إعدادات الشركة"""
+    from .serializers import tenant_contractor_cache_key
+    cache.delete(tenant_contractor_cache_key(instance.tenant_id))
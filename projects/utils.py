@@ -16,11 +16,19 @@ Structure:
             ├── invoices - الفواتير/
             └── payments - الدفعات/
 """
+import functools
+import logging
 import os
 import re
+import threading
+import weakref
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.core.files.storage import default_storage
+from django.utils.deconstruct import deconstructible
 from django.utils.text import slugify
 
+logger = logging.getLogger(__name__)
+
 
 # Project phases mapping
 # المفاتيح: القيم المستخدمة في الكود
@@ -42,9 +50,15 @@ PROJECT_PHASES = {
 }
 
 
+_FILENAME_DISALLOWED_RE = re.compile(r'[^\w\s\-_.\u0600-\u06FF]')
+_FILENAME_DASHES_RE = re.compile(r'[-_]+')
+
+
+@functools.lru_cache(maxsize=1024)
 def sanitize_filename(filename):
     """
     تنظيف اسم الملف من الأحرف غير المسموحة
+    ✅ الأسماء الثابتة (العقد_الأصيل_Original_Contract.pdf ...) تتكرر لكل مشروع - النتيجة مخزنة مؤقتاً
     
     Args:
         filename: اسم الملف الأصلي
@@ -57,13 +71,13 @@ def sanitize_filename(filename):
     
     # تنظيف الاسم من الأحرف غير المسموحة
     # السماح بالأحرف العربية والإنجليزية والأرقام والشرطة والشرطة السفلية والنقطة
-    name = re.sub(r'[^\w\s\-_.\u0600-\u06FF]', '', name)
+    name = _FILENAME_DISALLOWED_RE.sub('', name)
     
     # استبدال المسافات بشرطة سفلية
     name = name.replace(' ', '_')
     
     # إزالة الشرطات المتعددة
-    name = re.sub(r'[-_]+', '_', name)
+    name = _FILENAME_DASHES_RE.sub('_', name)
     
     return f"{name}{ext}" if ext else name
 
@@ -104,11 +118,31 @@ def clean_owner_name_en(owner_name_en):
     return cleaned
 
 
+def _build_project_folder_name(project_code, owner_name_en):
+    """بناء اسم مجلد المشروع من الكود واسم المالك (دالة نقية)"""
+    # تنظيف owner_name_en
+    cleaned_owner_name = clean_owner_name_en(owner_name_en) if owner_name_en else ""
+    
+    # بناء اسم المجلد
+    if cleaned_owner_name:
+        return f"project_{project_code}_{cleaned_owner_name}"
+    # إذا لم يكن هناك owner_name_en، نستخدم code فقط
+    return f"project_{project_code}"
+
+
+def invalidate_project_folder_name(project):
+    """حذف اسم المجلد المحفوظ على كائن المشروع (عند تغيّر الكود أو الملاك)"""
+    if project is not None and not isinstance(project, int):
+        project.__dict__.pop('_project_folder_name', None)
+
+
 def get_project_folder_name(project):
     """
     الحصول على اسم مجلد المشروع
     
     يستخدم project_{project_code}_{owner_name_en}
+    ✅ النتيجة تُحفظ على كائن المشروع نفسه (_project_folder_name) لتجنب تكرار
+    استعلامات الملاك عند حفظ عدة ملفات لنفس المشروع في نفس الطلب.
     
     Args:
         project: كائن Project أو project_id
@@ -128,6 +162,10 @@ def get_project_folder_name(project):
     if not hasattr(project, 'id') or not project.id:
         return "project_unknown"
     
+    cached = project.__dict__.get('_project_folder_name')
+    if cached is not None:
+        return cached
+    
     # الحصول على project_code (internal_code)
     project_code = getattr(project, 'internal_code', None)
     if not project_code or not project_code.strip():
@@ -136,45 +174,25 @@ def get_project_folder_name(project):
     # الحصول على owner_name_en من المالك المفوض (is_authorized=True)
     owner_name_en = ""
     try:
-        # محاولة الحصول على SitePlan باستخدام query مباشر لتجنب مشاكل الـ caching
-        from .models import SitePlan, SitePlanOwner
+        # ✅ استعلام واحد مباشر (بدون caching): المالك المفوض أولاً، وإلا الأول حسب id
+        from .models import SitePlanOwner
         try:
-            siteplan = SitePlan.objects.get(project_id=project.id)
-            if siteplan:
-                # البحث عن المالك المفوض أولاً (is_authorized=True)
-                authorized_owner = SitePlanOwner.objects.filter(
-                    siteplan=siteplan, 
-                    is_authorized=True
-                ).first()
-                if authorized_owner:
-                    owner_name_en = getattr(authorized_owner, 'owner_name_en', '') or ''
-                else:
-                    # إذا لم يكن هناك مالك مفوض، نستخدم الأول
-                    first_owner = SitePlanOwner.objects.filter(
-                        siteplan=siteplan
-                    ).order_by('id').first()
-                    if first_owner:
-                        owner_name_en = getattr(first_owner, 'owner_name_en', '') or ''
-        except SitePlan.DoesNotExist:
-            # لا يوجد siteplan - هذا طبيعي للمشاريع الجديدة
-            pass
+            # لا يوجد siteplan/ملاك (طبيعي للمشاريع الجديدة) → first() ترجع None
+            owner_name_en = (
+                SitePlanOwner.objects.filter(siteplan__project_id=project.id)
+                .order_by('-is_authorized', 'id')
+                .values_list('owner_name_en', flat=True)
+                .first()
+            ) or ''
         except Exception as e:
             # في حالة أي خطأ آخر، نستخدم fallback
-            import logging
-            logger = logging.getLogger(__name__)
             logger.debug(f"Error getting owner_name_en for project {project.id}: {e}")
     except Exception:
         pass
     
-    # تنظيف owner_name_en
-    cleaned_owner_name = clean_owner_name_en(owner_name_en) if owner_name_en else ""
-    
-    # بناء اسم المجلد
-    if cleaned_owner_name:
-        return f"project_{project_code}_{cleaned_owner_name}"
-    else:
-        # إذا لم يكن هناك owner_name_en، نستخدم code فقط
-        return f"project_{project_code}"
+    folder_name = _build_project_folder_name(project_code, owner_name_en)
+    project._project_folder_name = folder_name
+    return folder_name
 
 
 def get_project_file_path(project, phase, filename, subfolder=None):
@@ -211,8 +229,6 @@ def get_project_file_path(project, phase, filename, subfolder=None):
     # التحقق من صحة المرحلة (إذا لم تكن موجودة في المفاتيح أو القيم)
     if phase not in PROJECT_PHASES and phase not in PROJECT_PHASES.values():
         # السماح بالمراحل القديمة للتوافق
-        import logging
-        logger = logging.getLogger(__name__)
         logger.warning(f"Phase '{phase}' not found in PROJECT_PHASES, using as-is for backward compatibility")
     
     # ✅ استخراج اسم الملف فقط إذا كان filename يحتوي على مسار كامل (للويندوز)
@@ -289,8 +305,6 @@ def save_project_file(file_obj, project, phase, filename=None, subfolder=None, o
         try:
             default_storage.delete(file_path)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Could not delete existing file {file_path}: {e}")
     
     # حفظ الملف
@@ -337,8 +351,6 @@ def get_next_numbered_subfolder(project, phase, base_folder_name):
     Returns:
         str: رقم المجلد التالي بصيغة "01", "02", إلخ
     """
-    import logging
-    logger = logging.getLogger(__name__)
     
     try:
         project_folder = get_project_folder_name(project)
@@ -438,8 +450,6 @@ def create_project_folder_structure(project):
             ├── invoices - الفواتير/
             └── payments - الدفعات/
     """
-    import logging
-    logger = logging.getLogger(__name__)
     
     try:
         # الحصول على اسم مجلد المشروع
@@ -548,3 +558,72 @@ def create_project_folder_structure(project):
         logger.error(f"❌ Error creating folder structure for project: {e}", exc_info=True)
         return False
 
+
+@deconstructible
+class ProjectUploadTo:
+    """
+    callable موحد لـ upload_to يبني مسار الملف باسم ثابت داخل مجلد المشروع
+
+    Args:
+        category: مرحلة المشروع (مفتاح في PROJECT_PHASES) أو اسم مجلد حرفي إذا raw=True
+        label: اسم الملف الثابت بدون امتداد (الاسم_العربي_English_Name)
+        subfolder: مجلد فرعي داخل المرحلة (اختياري)
+        default_ext: امتداد افتراضي إذا لم يكن للملف امتداد (مثل '.pdf')
+        fallback: بادئة مسار Fallback عند عدم وجود مشروع (الافتراضي: category)
+        raw: استخدام category كاسم مجلد حرفي بدون PROJECT_PHASES (للمسارات القديمة)
+    """
+
+    def __init__(self, category, label, subfolder=None, default_ext=None, fallback=None, raw=False):
+        self.category = category
+        self.label = label
+        self.subfolder = subfolder
+        self.default_ext = default_ext
+        self.fallback = fallback
+        self.raw = raw
+
+    def __call__(self, instance, filename):
+        project = get_project_from_instance(instance)
+        # ✅ rpartition بدل os.path.splitext (نفس النتيجة للأسماء بدون مسار)
+        stem, dot, ext = filename.rpartition('/')[2].rpartition('.')
+        ext = '.' + ext if dot and stem.lstrip('.') else (self.default_ext or '')
+        clean_filename = self.label + ext
+        if project:
+            if not self.raw:
+                return get_project_file_path(project, self.category, clean_filename, subfolder=self.subfolder)
+            parts = ['projects', get_project_folder_name(project), self.category]
+        else:
+            # Fallback للتوافق مع البيانات القديمة
+            parts = [self.fallback or self.category]
+        if self.subfolder:
+            parts.append(self.subfolder)
+        parts.append(clean_filename)
+        return '/'.join(parts)
+
+
+def make_upload_to(category, label, subfolder=None, default_ext=None, fallback=None, raw=False):
+    """إنشاء upload_to موحد (انظر ProjectUploadTo)"""
+    return ProjectUploadTo(category, label, subfolder=subfolder, default_ext=default_ext, fallback=fallback, raw=raw)
+
+
+_pending_on_commit = threading.local()
+
+
+def on_commit_once(key, func, using=None):
+    """
+    ✅ تسجيل func مرة واحدة لكل key داخل نفس الـ transaction
+    - المرجع ضعيف: إذا تراجع الـ transaction/savepoint يحذف Django الـ callback
+      فيختفي من هنا ويُعاد تسجيله عند أول تعديل لاحق
+    """
+    pending = getattr(_pending_on_commit, 'callbacks', None)
+    if pending is None:
+        pending = _pending_on_commit.callbacks = weakref.WeakValueDictionary()
+    key = (using or DEFAULT_DB_ALIAS, key)
+    if key in pending:
+        return
+
+    def _run():
+        pending.pop(key, None)
+        func()
+
+    pending[key] = _run
+    transaction.on_commit(_run, using=using)
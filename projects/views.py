@@ -5,10 +5,12 @@ from django.views.decorators.csrf import ensure_csrf_cookie
 from django.db import models
 from django.conf import settings
 from django.core.cache import cache
+import hashlib
+import logging
 import os
 from pathlib import Path
-import hashlib
 
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
@@ -42,6 +44,9 @@ from authentication.utils import (
     can_manage_contracts, can_manage_payments, is_company_admin, is_staff_user,
     log_audit, get_client_ip
 )
+from authentication.models import TenantSettings
+
+logger = logging.getLogger(__name__)
 
 
 # ===============================
@@ -53,6 +58,22 @@ def csrf_ping(request):
     return JsonResponse({"ok": True})
 
 
+class _LargeChunkTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """قراءة الرفع بأجزاء 1MB بدل 64KB الافتراضية (ملفات المخططات كبيرة)"""
+    chunk_size = 1024 * 1024
+
+
+class _TempFileUploadMixin:
+    """
+    ✅ كتابة كل الملفات المرفوعة إلى ملف مؤقت على القرص بدل الذاكرة
+    (العقود والمخططات قد تتعدد في طلب واحد وتضخم ذاكرة الـ worker)
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        request.upload_handlers = [_LargeChunkTemporaryFileUploadHandler(request)]
+        return super().dispatch(request, *args, **kwargs)
+
+
 # ===============================
 # المشاريع
 # ===============================
@@ -70,8 +91,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
             try:
                 queryset = queryset.select_related('tenant')  # ForeignKey مضمون
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.warning(f"Error in select_related('tenant'): {e}")
             
             # ✅ دعم include parameter لتحميل العلاقات المطلوبة
@@ -94,8 +113,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
                     try:
                         queryset = queryset.select_related(*select_related_fields)
                     except Exception as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
                         logger.warning(f"Error in select_related for include: {e}")
             
             # ✅ select_related للـ User fields (لتجنب N+1 queries)
@@ -109,14 +126,12 @@ class ProjectViewSet(viewsets.ModelViewSet):
                     'current_stage',  # WorkflowStage
                 )
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.warning(f"Error in select_related for User fields: {e}")
-            
+
+            # ✅ has_siteplan / has_license / completion من annotations بدل استعلامات لكل مشروع
+            queryset = queryset.with_completion_flags()
+
             # ✅ prefetch_related للعلاقات العكسية (آمنة حتى لو كانت فارغة)
-            # ✅ إضافة prefetch لـ siteplan__owners لتجنب N+1 في get_display_name
-            from django.db.models import Prefetch
-            
             prefetch_fields = [
                 'payments',  # Reverse ForeignKey
                 'variations',  # Reverse ForeignKey
@@ -125,20 +140,15 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 'consultants__consultant',  # Nested prefetch
             ]
             
-            # ✅ إضافة prefetch لـ siteplan__owners (مطلوب دائماً لـ get_display_name)
-            # ✅ استخدام Prefetch object لتحسين الأداء
-            prefetch_fields.append(
-                Prefetch(
-                    'siteplan__owners',
-                    queryset=SitePlanOwner.objects.order_by('id')
-                )
-            )
+            # ✅ siteplan والملاك مطلوبان فقط لـ siteplan_data (get_display_name يقرأ Project.name المخزن)
+            if 'siteplan' in [item.strip() for item in include_param.split(',')]:
+                from django.db.models import Prefetch
+                queryset = queryset.select_related('siteplan')
+                prefetch_fields.append(Prefetch('siteplan__owners', queryset=SitePlanOwner.objects.order_by('id')))
             
             try:
                 queryset = queryset.prefetch_related(*prefetch_fields)
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.warning(f"Error in prefetch_related: {e}")
                 # نكمل بدون prefetch_related إذا فشل
             
@@ -147,8 +157,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 return queryset
             
             # تصفية حسب tenant المستخدم
-            import logging
-            logger = logging.getLogger(__name__)
             
             user_tenant = None
             if hasattr(self.request, 'tenant') and self.request.tenant:
@@ -184,8 +192,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
             
             return queryset
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error in get_queryset: {e}", exc_info=True)
             # ✅ إرجاع queryset فارغ في حالة الخطأ
             return Project.objects.none()
@@ -194,8 +200,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
         """معالجة آمنة لقراءة قائمة المشاريع مع التعامل مع الأخطاء والـ caching"""
         try:
             # ✅ تسجيل معلومات للتشخيص
-            import logging
-            logger = logging.getLogger(__name__)
             
             # ✅ محاولة استخدام cache إذا كان متاحاً
             cache_key = None
@@ -246,8 +250,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
             
             return response
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"❌ Error listing projects: {e}", exc_info=True)
             # ✅ إرجاع قائمة فارغة بدلاً من 500 error
             return Response([], status=status.HTTP_200_OK)
@@ -257,8 +259,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
         try:
             return super().retrieve(request, *args, **kwargs)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error retrieving project {kwargs.get('pk')}: {e}", exc_info=True)
             # ✅ إرجاع 404 بدلاً من 500 error
             return Response(
@@ -268,7 +268,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """ربط المشروع الجديد بـ tenant المستخدم والتحقق من Limits"""
-        from authentication.models import TenantSettings
         from rest_framework import serializers as drf_serializers
         
         tenant = None
@@ -350,8 +349,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
                         except Exception:
                             pass
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Error clearing projects cache: {e}")
     
     @action(detail=True, methods=['post'])
@@ -677,8 +674,6 @@ class ProjectViewSet(viewsets.ModelViewSet):
             can_submit_project, can_approve_stage, can_final_approve,
             can_edit_project, can_create_project, is_manager, is_company_admin
         )
-        import logging
-        logger = logging.getLogger(__name__)
         
         project = self.get_object()
         user = request.user
@@ -808,8 +803,6 @@ class _ProjectChildViewSet(viewsets.ModelViewSet):
             if hasattr(queryset.model, 'tenant'):
                 queryset = queryset.select_related('tenant')
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Error in select_related: {e}")
             # نكمل بدون select_related إذا فشل
         
@@ -845,8 +838,6 @@ class _ProjectChildViewSet(viewsets.ModelViewSet):
         project = self._get_project()
         # ربط البيانات بـ tenant المشروع
         instance = serializer.save(project=project, tenant=project.tenant)
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"Created {self.queryset.model.__name__} with ID {instance.id} for project {project.id} and tenant {project.tenant.id if project.tenant else 'None'}")
 
     def perform_update(self, serializer):
@@ -866,6 +857,9 @@ class SitePlanViewSet(_ProjectChildViewSet):
     queryset = SitePlan.objects.all().order_by("-created_at")
     serializer_class = SitePlanSerializer
 
+    def get_queryset(self):
+        return SitePlanSerializer.setup_eager_loading(super().get_queryset())
+
     def create(self, request, *args, **kwargs):
         project = self._get_project()
         if hasattr(project, "siteplan"):
@@ -880,8 +874,6 @@ class SitePlanViewSet(_ProjectChildViewSet):
         try:
             return super().list(request, *args, **kwargs)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error listing SitePlan for project {kwargs.get('project_pk')}: {e}", exc_info=True)
             # ✅ إرجاع قائمة فارغة بدلاً من 500 error
             return Response([], status=status.HTTP_200_OK)
@@ -891,8 +883,6 @@ class SitePlanViewSet(_ProjectChildViewSet):
         try:
             return super().retrieve(request, *args, **kwargs)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error retrieving SitePlan {kwargs.get('pk')} for project {kwargs.get('project_pk')}: {e}", exc_info=True)
             # ✅ إرجاع 404 بدلاً من 500 error
             return Response(
@@ -993,7 +983,6 @@ class BuildingLicenseViewSet(_ProjectChildViewSet):
             restored_count += 1
         
         # ✅ تحديث اسم المشروع
-        siteplan.refresh_from_db()
         serializer_instance = SitePlanSerializer()
         serializer_instance._update_project_name_from_owners(siteplan)
         
@@ -1011,7 +1000,7 @@ class BuildingLicenseViewSet(_ProjectChildViewSet):
 # ===============================
 # Contract (OneToOne + Snapshot من License)
 # ===============================
-class ContractViewSet(_ProjectChildViewSet):
+class ContractViewSet(_TempFileUploadMixin, _ProjectChildViewSet):
     queryset = Contract.objects.all().order_by("-created_at")
     serializer_class = ContractSerializer
 
@@ -1087,7 +1076,7 @@ class AwardingViewSet(_ProjectChildViewSet):
 # ===============================
 # StartOrder (OneToOne)
 # ===============================
-class StartOrderViewSet(_ProjectChildViewSet):
+class StartOrderViewSet(_TempFileUploadMixin, _ProjectChildViewSet):
     queryset = StartOrder.objects.all().order_by("-created_at")
     serializer_class = StartOrderSerializer
 
@@ -1104,7 +1093,7 @@ class StartOrderViewSet(_ProjectChildViewSet):
 # ===============================
 # Project Schedule
 # ===============================
-class ProjectScheduleViewSet(_ProjectChildViewSet):
+class ProjectScheduleViewSet(_TempFileUploadMixin, _ProjectChildViewSet):
     queryset = ProjectSchedule.objects.all().order_by("-created_at")
     serializer_class = ProjectScheduleSerializer
 
@@ -1138,7 +1127,7 @@ class ExcavationStartNoticeViewSet(_ProjectChildViewSet):
 # ===============================
 # Payment (ManyToOne - يمكن أن يكون بدون مشروع)
 # ===============================
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(_TempFileUploadMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all().order_by("-date", "-created_at")
     serializer_class = PaymentSerializer
     parser_classes = (MultiPartParser, FormParser, JSONParser)
@@ -1162,8 +1151,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
             return queryset
         except Exception as e:
             # ✅ إذا كان الجدول غير موجود، نرجع queryset فارغ
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error getting payments queryset: {e}")
             return Payment.objects.none()
 
@@ -1171,8 +1158,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
         try:
             return super().list(request, *args, **kwargs)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error listing payments: {e}")
             # ✅ إرجاع قائمة فارغة بدلاً من 500 error
             return Response([], status=status.HTTP_200_OK)
@@ -1239,8 +1224,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
                             tenant=payment.tenant
                         )
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"Error linking/creating ActualInvoice for payment {payment.id}: {e}")
                 # Re-raise validation errors
                 from rest_framework import serializers as drf_serializers
@@ -1323,8 +1306,6 @@ class ActualInvoiceViewSet(_ProjectChildViewSet):
         try:
             return super().list(request, *args, **kwargs)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error listing actual invoices: {e}", exc_info=True)
             # ✅ Return empty list instead of 500 error if items field doesn't exist
             return Response([], status=status.HTTP_200_OK)
@@ -1334,8 +1315,6 @@ class ActualInvoiceViewSet(_ProjectChildViewSet):
         try:
             return super().retrieve(request, *args, **kwargs)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error retrieving actual invoice: {e}", exc_info=True)
             return Response(
                 {"detail": "Error retrieving invoice. Please check database schema."},
@@ -1346,14 +1325,20 @@ class ActualInvoiceViewSet(_ProjectChildViewSet):
 # =========================
 # Helper Functions for Recalculation
 # =========================
+_CONTRACT_VALUE_FIELDS = (
+    'id', 'project_id', 'contract_classification',
+    'total_project_value', 'total_bank_value', 'total_owner_value',
+)
+
+
 def _recalculate_project_after_variation(project, variation):
     """Recalculate project values after adding/updating a variation"""
     try:
         from decimal import Decimal
         
-        # Get contract
+        # Get contract (✅ only the value fields - not the 20+ FileField paths)
         try:
-            contract = project.contract
+            contract = Contract.objects.only(*_CONTRACT_VALUE_FIELDS).get(project=project)
         except Contract.DoesNotExist:
             return
         
@@ -1392,8 +1377,6 @@ def _recalculate_project_after_variation(project, variation):
         contract.save(update_fields=['total_project_value', 'total_owner_value'])
         
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error recalculating project after variation: {e}")
 
 
@@ -1402,9 +1385,9 @@ def _recalculate_project_after_variation_removal(project, removed_net_with_vat):
     try:
         from decimal import Decimal
         
-        # Get contract
+        # Get contract (✅ only the value fields - not the 20+ FileField paths)
         try:
-            contract = project.contract
+            contract = Contract.objects.only(*_CONTRACT_VALUE_FIELDS).get(project=project)
         except Contract.DoesNotExist:
             return
         
@@ -1428,8 +1411,6 @@ def _recalculate_project_after_variation_removal(project, removed_net_with_vat):
         contract.save(update_fields=['total_project_value', 'total_owner_value'])
         
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error recalculating project after variation removal: {e}")
 
 
@@ -1446,12 +1427,9 @@ def download_file(request, file_path):
     - الملفات الحساسة (contracts, projects): IsAuthenticated (تحتاج authentication)
     يستقبل مسار الملف النسبي (مثل: contracts/main/file.pdf أو tenants/logos/logo.png)
     """
-    import logging
     import urllib.parse
     import mimetypes
     
-    logger = logging.getLogger(__name__)
-    
     # ✅ معالجة OPTIONS requests (CORS preflight) أولاً - قبل أي معالجة أخرى
     if request.method == 'OPTIONS':
         response = Response()
@@ -1806,7 +1784,12 @@ class ConsultantViewSet(viewsets.ModelViewSet):
     def projects(self, request, pk=None):
         """الحصول على قائمة المشاريع المرتبطة بالاستشاري"""
         consultant = self.get_object()
-        project_consultants = ProjectConsultant.objects.filter(consultant=consultant)
+        # ✅ تحميل المشروع في نفس الاستعلام مع الأعمدة الخفيفة فقط
+        project_consultants = (
+            ProjectConsultant.objects.filter(consultant=consultant)
+            .select_related('project')
+            .only('role', 'project__id', 'project__name')
+        )
         
         projects_data = []
         for pc in project_consultants:
@@ -1814,7 +1797,7 @@ class ConsultantViewSet(viewsets.ModelViewSet):
                 "project_id": pc.project.id,
                 "project_name": pc.project.name or f"Project #{pc.project.id}",
                 "role": pc.role,
-                "role_display": dict(ProjectConsultant.ROLE_CHOICES).get(pc.role, pc.role),
+                "role_display": ProjectConsultant._ROLE_MAP.get(pc.role, pc.role),
             })
         
         return Response(projects_data)